@@ -0,0 +1,187 @@
+"""
+On-disk cache of LLM responses.
+
+Requests are sent at a low temperature, so the same messages to the same model
+get (practically) the same response. With ``LLM_CACHE=true``, responses are cached
+by a hash of the provider, model, parameters and messages, so replaying a conversation,
+rerunning evals, or summarizing the same messages again doesn't pay for another request.
+
+Entries expire after ``LLM_CACHE_TTL`` seconds, and the least recently used ones
+are evicted when the cache grows over ``LLM_CACHE_SIZE`` megabytes.
+"""
+
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from collections.abc import Callable, Iterator
+
+from .config import get_config
+from .dirs import get_cache_dir
+from .message import Message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_SIZE_MB = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    chunks TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def request_key(
+    provider: str, model: str, params: dict, messages: list[Message], stream: bool
+) -> str:
+    """Hashes everything that determines the response to a request."""
+    request = {
+        "provider": provider,
+        "model": model,
+        "params": params,
+        "stream": stream,
+        "messages": [
+            [msg.role, msg.content, [str(f) for f in msg.files]] for msg in messages
+        ],
+    }
+    data = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode(errors="surrogatepass")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Responses by request key, as the chunks they were streamed in.
+
+    Streams that were stopped early (like when pausing on a tool use) are cached as incomplete.
+    Replaying one continues with a request if more than the cached chunks are read.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_SIZE_MB * 2**20,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # used from the provider thread and callers, guarded by the lock
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def get(self, key: str) -> tuple[list[str], bool] | None:
+        """Returns the cached chunks of a response and whether it's complete, counting a hit or miss."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT chunks, complete FROM responses WHERE key = ? AND created > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with conn:
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), bool(row[1])
+
+    def put(self, key: str, chunks: list[str], complete: bool = True) -> None:
+        data = json.dumps(chunks, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, data, complete, len(data), now, now),
+                )
+                self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # delete the least recently used entries, until the rest fit
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        evict = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+        logger.debug(f"Evicted {len(evict)} cached responses")
+
+    def stream(self, key: str, request: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """Replays a cached response chunk by chunk, or streams it with `request` and caches it."""
+        cached = self.get(key)
+        chunks: list[str] = []
+        if cached is not None:
+            chunks, complete = cached
+            yield from chunks
+            if complete:
+                return
+            logger.info("Cached response was incomplete, continuing with a request")
+        yield from self._stream_request(key, request, chunks)
+
+    def _stream_request(
+        self, key: str, request: Callable[[], Iterator[str]], cached: list[str]
+    ) -> Iterator[str]:
+        # skip what was already replayed from the cache, the response is expected to be the same
+        skip = sum(map(len, cached))
+        chunks = list(cached)
+        complete = False
+        try:
+            for chunk in request():
+                if skip:
+                    n = min(skip, len(chunk))
+                    chunk, skip = chunk[n:], skip - n
+                    if not chunk:
+                        continue
+                chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            if chunks:
+                self.put(key, chunks, complete)
+
+
+_cache: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache | None:
+    """Returns the response cache, or None if it isn't enabled with ``LLM_CACHE``."""
+    global _cache
+    config = get_config()
+    if config.get_env("LLM_CACHE", "false") not in ["1", "true"]:
+        return None
+    if _cache is None:
+        _cache = ResponseCache(
+            get_cache_dir() / "responses.sqlite",
+            ttl=float(config.get_env("LLM_CACHE_TTL") or DEFAULT_TTL),
+            max_bytes=int(float(config.get_env("LLM_CACHE_SIZE") or DEFAULT_SIZE_MB) * 2**20),
+        )
+    return _cache
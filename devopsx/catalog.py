@@ -0,0 +1,180 @@
+"""
+Catalog of conversations in the logs dir.
+
+An incrementally maintained SQLite index of the conversations, so listing them
+(for `--resume`, the conversation picker, and the server API) doesn't need to glob
+the logs dir and read every conversation. Updated by the LogManager on write,
+and can be rebuilt from disk with `reindex()`.
+"""
+
+import os
+import atexit
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from contextlib import contextmanager
+from collections.abc import Generator
+
+from .dirs import get_logs_dir
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILENAME = "index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    created REAL NOT NULL,
+    modified REAL NOT NULL,
+    messages INTEGER NOT NULL,
+    branches INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_modified ON conversations (modified DESC);
+"""
+
+
+@dataclass(frozen=True)
+class Entry:
+    name: str
+    path: str
+    created: float
+    modified: float
+    messages: int
+    branches: int
+
+
+def get_catalog_path() -> Path:
+    return get_logs_dir() / CATALOG_FILENAME
+
+
+# one connection per process, since the catalog is updated on every appended message
+_conn: sqlite3.Connection | None = None
+_conn_path: Path | None = None
+_conn_lock = threading.RLock()
+
+
+@contextmanager
+def _connect() -> Generator[sqlite3.Connection, None, None]:
+    """Holds the connection to the catalog, opened on first use or if the logs dir changed."""
+    global _conn, _conn_path
+    path = get_catalog_path()
+    with _conn_lock:
+        # reopen if the catalog was deleted, to not write to the unlinked file
+        if _conn is None or _conn_path != path or not path.exists():
+            _close()
+            conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            # WAL without fsync on every commit, the catalog can always be rebuilt from the logs
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _conn, _conn_path = conn, path
+        yield _conn
+
+
+@atexit.register
+def _close() -> None:
+    global _conn, _conn_path
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+        _conn, _conn_path = None, None
+
+
+def update(entry: Entry) -> None:
+    """Inserts or replaces the entry for a conversation."""
+    with _connect() as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                entry.name,
+                entry.path,
+                entry.created,
+                entry.modified,
+                entry.messages,
+                entry.branches,
+            ),
+        )
+
+
+def touch(name: str, modified: float, branches: int) -> bool:
+    """Updates the modified time and branch count of a conversation, returns False if it isn't in the catalog."""
+    with _connect() as conn, conn:
+        cur = conn.execute(
+            "UPDATE conversations SET modified = ?, branches = ? WHERE name = ?",
+            (modified, branches, name),
+        )
+        return cur.rowcount > 0
+
+
+def remove(name: str) -> None:
+    with _connect() as conn, conn:
+        conn.execute("DELETE FROM conversations WHERE name = ?", (name,))
+
+
+def get_entries() -> Generator[Entry, None, None]:
+    """Returns all entries, most recently modified first."""
+    with _connect() as conn:
+        # fetch all up front, to not hold the connection while the caller iterates
+        rows = conn.execute(
+            "SELECT * FROM conversations ORDER BY modified DESC"
+        ).fetchall()
+    for row in rows:
+        yield Entry(*row)
+
+
+def sync() -> None:
+    """Adds conversations missing from the catalog, and removes ones that no longer exist."""
+    logsdir = get_logs_dir()
+    with _connect() as conn:
+        indexed = {row[0] for row in conn.execute("SELECT name FROM conversations")}
+    # scandir gives us the names without a stat per conversation
+    on_disk = {e.name for e in os.scandir(logsdir) if e.is_dir()}
+    for name in on_disk - indexed:
+        if entry := scan(logsdir / name):
+            update(entry)
+    for name in indexed - on_disk:
+        remove(name)
+
+
+def reindex() -> int:
+    """Rebuilds the catalog from the logs on disk, returns the number of conversations indexed."""
+    logsdir = get_logs_dir()
+    entries = [
+        entry
+        for e in os.scandir(logsdir)
+        if e.is_dir() and (entry := scan(Path(e.path)))
+    ]
+    with _connect() as conn, conn:
+        conn.execute("DELETE FROM conversations")
+        conn.executemany(
+            "INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (e.name, e.path, e.created, e.modified, e.messages, e.branches)
+                for e in entries
+            ],
+        )
+    logger.info(f"Reindexed {len(entries)} conversations")
+    return len(entries)
+
+
+def scan(logdir: Path) -> Entry | None:
+    """Reads the catalog entry for a conversation from disk."""
+    # noreorder
+    from .logmanager import _count_log, _find_logfile, _read_log  # fmt: skip
+
+    conv_fn = _find_logfile(logdir)
+    if not conv_fn:
+        return None
+    modified = conv_fn.stat().st_mtime
+    msgs = _read_log(conv_fn, limit=1)
+    return Entry(
+        name=logdir.name,
+        path=str(conv_fn),
+        created=msgs[0].timestamp.timestamp() if msgs else modified,
+        modified=modified,
+        messages=_count_log(conv_fn),
+        branches=1 + len(list(logdir.glob(f"branches/*{conv_fn.suffix}"))),
+    )
@@ -3,6 +3,7 @@ import re
 import sys
 import time
 import errno
+import atexit
 import signal
 import logging
 import readline
@@ -326,6 +327,8 @@ def chat(
     log = LogManager.load(
         logdir, initial_msgs=initial_msgs, show_hidden=show_hidden, create=True
     )
+    # messages are appended to the journal as we go, compact it on exit
+    atexit.register(log.compact)
 
     # change to workspace directory
     # use if exists, create if @log, or use given path
@@ -606,6 +609,7 @@ def _include_paths(msg: Message) -> Message:
     # TODO: this will misbehave if there are codeblocks (or triple backticks) in codeblocks
     content_no_codeblocks = re.sub(r"```.*?\n```", "", msg.content, flags=re.DOTALL)
     append_msg = ""
+    files = []
     for word in re.split(r"[\s`]", content_no_codeblocks):
         # remove wrapping backticks
         word = word.strip("`")
@@ -630,11 +634,13 @@ def _include_paths(msg: Message) -> Message:
 
             file = _parse_prompt_files(word)
             if file:
-                msg.files.append(file)
+                files.append(file)
 
     # append the message with the file contents
     if append_msg:
         msg = msg.replace(content=msg.content + append_msg)
+    if files:
+        msg = msg.replace(files=[*msg.files, *files])
 
     return msg
 
@@ -1,3 +1,4 @@
+import re
 from xml.etree import ElementTree
 from collections.abc import Generator
 from dataclasses import dataclass, field
@@ -50,36 +51,39 @@ class Codeblock:
         return list(_extract_codeblocks(markdown))
 
 
+# a line starting with a fence, up to the end of the line
+_fence_re = re.compile(r"^[^\S\n]*```([^\n]*)", re.MULTILINE)
+
+
 def _extract_codeblocks(markdown: str) -> Generator[Codeblock, None, None]:
+    """
+    Yields the outermost codeblocks, with `start` set to the offset of their opening fence.
+
+    Scans the fences in a single pass, only the contents of the outermost blocks are copied.
+    """
     # speed check (early exit): check if message contains a code block
     backtick_count = markdown.count("```")
     if backtick_count < 2:
         return
 
-    lines = markdown.split("\n")
     stack: list[str] = []
-    current_block = []
+    start = 0
+    content_start = 0
     current_lang = ""
 
-    for idx, line in enumerate(lines):
-        # not actually the starting index, but close enough
-        # TODO: fix to actually be correct
-        start_idx = sum(len(line) + 1 for line in lines[:idx])
-        stripped_line = line.strip()
-        if stripped_line.startswith("```"):
-            if not stack:  # Start of a new block
-                stack.append(stripped_line[3:])
-                current_lang = stripped_line[3:]
-            elif stripped_line[3:] and stack[-1] != stripped_line[3:]:  # Nested start
-                current_block.append(line)
-                stack.append(stripped_line[3:])
-            else:  # End of a block
-                if len(stack) == 1:  # Outermost block
-                    yield Codeblock(current_lang, "\n".join(current_block), start=start_idx)
-                    current_block = []
-                    current_lang = ""
-                else:  # Nested end
-                    current_block.append(line)
-                stack.pop()
-        elif stack:
-            current_block.append(line)
\ No newline at end of file
+    for m in _fence_re.finditer(markdown):
+        lang = m.group(1).rstrip()
+        if not stack:  # Start of a new block
+            stack.append(lang)
+            current_lang = lang
+            start = m.start(1) - 3
+            content_start = m.end() + 1
+        elif lang and stack[-1] != lang:  # Nested start
+            stack.append(lang)
+        else:  # End of a block
+            if len(stack) == 1:  # Outermost block
+                # the content ends before the newline preceding the closing fence
+                content = markdown[content_start : max(m.start() - 1, content_start)]
+                yield Codeblock(current_lang, content, start=start)
+                current_lang = ""
+            stack.pop()
@@ -8,6 +8,10 @@ from tabulate import tabulate
 from collections.abc import Generator
 
 from . import llm
+from . import catalog
+from .cache import get_response_cache
+from .promptcache import get_usage
+from .ratelimit import get_rate_limiter
 from .logmanager import LogManager
 from .message import Message, msgs_to_toml, print_msg, toml_to_msgs, len_tokens
 from .useredit import edit_text_with_editor
@@ -32,6 +36,8 @@ Actions = Literal[
     "tools",
     "models",
     "tokens",
+    "reindex",
+    "migrate",
     "help",
     "exit",
 ]
@@ -49,6 +55,8 @@ action_descriptions: dict[Actions, str] = {
     "tokens": "Show the number of tokens used",
     "tools": "Show available tools",
     "models": "Show available models",
+    "reindex": "Rebuild the index of conversations",
+    "migrate": "Convert the conversation log to another format (jsonl, msgpack)",
     "help": "Show this help message",
     "exit": "Exit the program",
 }
@@ -136,6 +144,18 @@ def handle_cmd(
                 print(f"Model: {model.model}")
                 if model.price_input:
                     print(f"Cost (input): ${n_tokens * model.price_input / 1_000_000}")
+            if cache := get_response_cache():
+                print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+            for provider, usage in get_usage().items():
+                print(
+                    f"Prompt cache ({provider}): {usage.cache_read_tokens}/{usage.input_tokens} input tokens cached "
+                    f"({usage.hit_rate:.0%}), {usage.cache_write_tokens} written"
+                )
+            for key, stats in get_rate_limiter().stats().items():
+                print(
+                    f"Rate limit {key}: {stats.requests} requests, {stats.queued} queued (max {stats.max_queued}), "
+                    f"waited {stats.wait_total:.1f}s (max {stats.wait_max:.1f}s)"
+                )
         case "tools":
             log.undo(1, quiet=True)
             print("Available tools:")
@@ -158,6 +178,19 @@ def handle_cmd(
 - [blue]{model}[/blue] (provider: [cyan]{provider}[/cyan], context window: {details["context"]})
                     """.strip()
                     )
+        case "reindex":
+            log.undo(1, quiet=True)
+            n_convs = catalog.reindex()
+            print(f"Reindexed {n_convs} conversations")
+        case "migrate":
+            log.undo(1, quiet=True)
+            fmt = args[0] if args else input("Format (jsonl, msgpack): ")
+            try:
+                log.migrate(fmt)  # type: ignore
+            except ValueError as e:
+                print(f"Error: {e}")
+            else:
+                print(f"Conversation log is now stored as {log.format.name}")
         case _:
             # the case for python, shell, and other block_types supported by tools
             tooluse = ToolUse(name, [], full_args)
@@ -17,6 +17,10 @@ logger = logging.getLogger(__name__)
 class Config:
     prompt: dict
     env: dict
+    # settings for the HTTP connection pool, see `transport.HTTPConfig`
+    http: dict = field(default_factory=dict)
+    # requests and tokens per minute by provider or model, see `ratelimit.Limits`
+    rate_limits: dict = field(default_factory=dict)
 
     def get_env(self, key: str, default: str | None = None) -> str | None:
         """Gets an enviromnent variable, checks the config file if it's not set in the environment."""
@@ -31,10 +35,15 @@ class Config:
         )
 
     def dict(self) -> dict:
-        return {
+        d = {
             "prompt": self.prompt,
             "env": self.env,
         }
+        if self.http:
+            d["http"] = self.http
+        if self.rate_limits:
+            d["rate_limits"] = self.rate_limits
+        return d
 
 
 @dataclass
@@ -83,9 +92,11 @@ def load_config() -> Config:
     assert "env" in config, "env key missing in config"
     prompt = config.pop("prompt")
     env = config.pop("env")
+    http = config.pop("http", {})
+    rate_limits = config.pop("rate_limits", {})
     if config:
         logger.warning(f"Unknown keys in config: {config.keys()}")
-    return Config(prompt=prompt, env=env)
+    return Config(prompt=prompt, env=env, http=http, rate_limits=rate_limits)
 
 
 def _load_config() -> tomlkit.TOMLDocument:
@@ -1,13 +1,16 @@
 import atexit
 import logging
 import readline
+from pathlib import Path
 from dotenv import load_dotenv
 
 from .config import load_config, config_path, set_config_value
 from .dirs import get_readline_history_file
-from .llm import init_llm
+from .llm import init_llm, init_routing
 from .models import set_default_model, PROVIDERS, get_recommended_model
+from .routing import Route
 from .tabcomplete import register_tabcomplete
+from .tokens import preload_encodings, warmup
 from .tools import init_tools
 from .util import console
 
@@ -75,6 +78,19 @@ def init(model: str | None, interactive: bool, tool_allowlist: list[str] | None,
         
     set_default_model(model)
 
+    # fallback providers, like LLM_FALLBACK="anthropic/claude-3-5-sonnet-20240620,groq/llama-3.1-70b-versatile"
+    if fallback := config.get_env("LLM_FALLBACK"):
+        hedge_ms = config.get_env("LLM_HEDGE_MS")
+        init_routing(
+            _init_fallbacks(provider, fallback),
+            hedge_after=float(hedge_ms) / 1000 if hedge_ms else None,
+        )
+
+    # load the tokenizer in the background, so the first turn doesn't wait for it
+    if tokenizer_dir := config.get_env("TOKENIZER_DIR"):
+        preload_encodings(Path(tokenizer_dir).expanduser())
+    warmup()
+
     if interactive:
         _load_readline_history()
 
@@ -84,6 +100,28 @@ def init(model: str | None, interactive: bool, tool_allowlist: list[str] | None,
     init_tools(tool_allowlist)
 
 
+def _init_fallbacks(provider: str, fallback: str) -> list[Route]:
+    openai_providers = ["openai", "azure", "openrouter"]
+    initialized = {provider}
+    # these share a client, initializing another would replace the first one
+    openai_provider = provider if provider in openai_providers else None
+    routes = []
+    for route in map(Route.parse, fallback.split(",")):
+        if route.provider in openai_providers:
+            if openai_provider is None:
+                openai_provider = route.provider
+            elif route.provider != openai_provider:
+                logger.warning(
+                    f"Can't fall back to {route}, it shares a client with {openai_provider}, skipping"
+                )
+                continue
+        if route.provider not in initialized:
+            init_llm(route.provider, primary=False)
+            initialized.add(route.provider)
+        routes.append(route)
+    return routes
+
+
 def init_logging(verbose):
     # log init
     logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
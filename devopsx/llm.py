@@ -1,45 +1,61 @@
 import sys
+import time
 import shutil
+import asyncio
 import logging
+import threading
 from rich import print
-from typing import Literal
+from typing import IO, Any, Literal, TypeVar
 from functools import lru_cache
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Coroutine, Iterator
 
-from .tools import ToolUse
+from .tools import ToolUseDetector
 from .config import get_config
-from .constants import PROMPT_ASSISTANT
+from .cache import get_response_cache, request_key
+from .constants import PROMPT_ASSISTANT, TEMPERATURE, TOP_P
 from .message import Message, len_tokens, format_msgs
 from .models import MODELS, get_summary_model
+from .ratelimit import background, get_rate_limiter
+from .routing import Route, Router
 
-from .llm_anthropic import chat as chat_anthropic
+from .llm_anthropic import achat as achat_anthropic
 from .llm_anthropic import get_client as get_anthropic_client
 from .llm_anthropic import init as init_anthropic
-from .llm_anthropic import stream as stream_anthropic
+from .llm_anthropic import astream as astream_anthropic
 
-from .llm_openai import chat as chat_openai
-from .llm_openai import reasoning_chat as reasoning_chat_openai
+from .llm_openai import achat as achat_openai
+from .llm_openai import areasoning_chat as areasoning_chat_openai
 from .llm_openai import get_client as get_openai_client
 from .llm_openai import init as init_openai
-from .llm_openai import stream as stream_openai
+from .llm_openai import astream as astream_openai
 
-from .llm_groq import chat as chat_groq
+from .llm_groq import achat as achat_groq
 from .llm_groq import get_client as get_groq_client
 from .llm_groq import init as init_groq
-from .llm_groq import stream as stream_groq
+from .llm_groq import astream as astream_groq
 
-from .llm_ollama import chat as chat_ollama
+from .llm_ollama import achat as achat_ollama
 from .llm_ollama import get_client as get_ollama_client
 from .llm_ollama import init as init_ollama
-from .llm_ollama import stream as stream_ollama
+from .llm_ollama import astream as astream_ollama
 
 
 logger = logging.getLogger(__name__)
 
 Provider = Literal["openai", "azure", "openrouter", "local", "anthropic", "groq"]
 
-def init_llm(llm: str):
+# streamed output is written once this many characters are buffered,
+# or on the first chunk after this many seconds since the last write
+STREAM_FLUSH_CHARS = 512
+STREAM_FLUSH_INTERVAL = 0.05
+
+# the provider requests go to first, others can be initialized as fallbacks
+_provider: Provider | None = None
+
+
+def init_llm(llm: str, primary: bool = True):
     # set up API_KEY (if openai) and API_BASE (if local)
+    global _provider
     config = get_config()
 
     if llm in ["openai", "azure", "openrouter"]:
@@ -57,6 +73,14 @@ def init_llm(llm: str):
     else:
         print(f"Error: Unknown LLM: {llm}")
         sys.exit(1)
+    if primary:
+        _provider = llm  # type: ignore
+
+
+def init_routing(fallbacks: list[Route], hedge_after: float | None = None) -> None:
+    """Sets the routes to fall back to, in order, and the seconds to wait for a first token before hedging."""
+    _router.fallbacks = fallbacks
+    _router.hedge_after = hedge_after
 
 
 def reply(messages: list[Message], model: str, stream: bool = False, verbose: bool = True) -> Message:
@@ -70,32 +94,175 @@ def reply(messages: list[Message], model: str, stream: bool = False, verbose: bo
         return Message("assistant", response)
 
 
-def _chat_complete(messages: list[Message], model: str) -> str:
-    provider = _client_to_provider()
+async def achat_complete(
+    messages: list[Message], model: str, provider: str | None = None
+) -> str:
+    """Generates a reply, without blocking the event loop. Defaults to the primary provider."""
+    provider = provider or _client_to_provider()
+    await _acquire(messages, model, provider)
     if provider in ["openai", "azure", "openrouter"]:
-        return reasoning_chat_openai(messages, model) if model.startswith("o1-") else chat_openai(messages, model)
+        if model.startswith("o1-"):
+            return await areasoning_chat_openai(messages, model)
+        return await achat_openai(messages, model)
     elif provider == "anthropic":
-        return chat_anthropic(messages, model)
+        return await achat_anthropic(messages, model)
     elif provider == "groq":
-        return chat_groq(messages, model)
+        return await achat_groq(messages, model)
     elif provider == "local":
-        return chat_ollama(messages, model)
+        return await achat_ollama(messages, model)
     else:
         raise ValueError("LLM not initialized")
 
 
-def _stream(messages: list[Message], model: str) -> Iterator[str]:
-    provider = _client_to_provider()
+async def astream(
+    messages: list[Message], model: str, provider: str | None = None
+) -> AsyncIterator[str]:
+    """Streams a reply, without blocking the event loop. Defaults to the primary provider."""
+    provider = provider or _client_to_provider()
+    await _acquire(messages, model, provider)
     if provider in ["openai", "azure", "openrouter"]:
-        return stream_openai(messages, model)
+        stream = astream_openai(messages, model)
     elif provider == "anthropic":
-        return stream_anthropic(messages, model)
+        stream = astream_anthropic(messages, model)
     elif provider == "groq":
-        return stream_groq(messages, model)
+        stream = astream_groq(messages, model)
     elif provider == "local":
-        return stream_ollama(messages, model)
+        stream = astream_ollama(messages, model)
     else:
         raise ValueError("LLM not initialized")
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+
+
+async def _acquire(messages: list[Message], model: str, provider: str) -> None:
+    # waits for the rate limits of the provider, if any, with the input tokens estimated locally
+    await get_rate_limiter().acquire(
+        provider, model, tokens=lambda: len_tokens(messages, model)
+    )
+
+
+# routes requests to the primary provider, and to the fallbacks set with `init_routing`
+_router = Router(achat_complete, astream)
+
+
+def _routes(model: str) -> list[Route]:
+    primary = Route(_client_to_provider(), model)
+    return [primary, *(route for route in _router.fallbacks if route != primary)]
+
+
+def _chat_complete(messages: list[Message], model: str) -> str:
+    def request() -> str:
+        return _run_sync(_router.achat(messages, _routes(model)))
+
+    if (cache := get_response_cache()) is None:
+        return request()
+    key = _request_key(messages, model, stream=False)
+    if cached := cache.get(key):
+        return "".join(cached[0])
+    content = request()
+    cache.put(key, [content])
+    return content
+
+
+def _stream(messages: list[Message], model: str) -> Iterator[str]:
+    def request() -> Iterator[str]:
+        return _iter_sync(_router.astream(messages, _routes(model)))
+
+    if (cache := get_response_cache()) is None:
+        return request()
+    # cached under the requested model, even if a fallback responded
+    key = _request_key(messages, model, stream=True)
+    return cache.stream(key, request)
+
+
+def _request_key(messages: list[Message], model: str, stream: bool) -> str:
+    params = {"temperature": TEMPERATURE, "top_p": TOP_P}
+    return request_key(_client_to_provider(), model, params, messages, stream)
+
+
+# event loop in a background thread, which the sync API runs the async providers on,
+# shared so the clients' connection pools are reused across calls and threads
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def _run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """Runs a coroutine on the background loop, blocking until it's done."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def _iter_sync(items: AsyncIterator[T]) -> Iterator[T]:
+    """Iterates an async iterator on the background loop, blocking for each item."""
+    loop = _get_loop()
+    try:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(items.__anext__(), loop)
+            try:
+                item = future.result()
+            except StopAsyncIteration:
+                return
+            except BaseException:
+                # like KeyboardInterrupt, stop waiting for the next item
+                future.cancel()
+                raise
+            yield item
+    finally:
+        # close the request if iteration stopped early, like when pausing on a tool use
+        if aclose := getattr(items, "aclose", None):
+            try:
+                asyncio.run_coroutine_threadsafe(aclose(), loop).result()
+            except RuntimeError:
+                # still running the cancelled step
+                pass
+
+
+class _OutputBuffer:
+    """Coalesces streamed output into fewer writes to a terminal."""
+
+    def __init__(
+        self,
+        file: IO[str],
+        size: int = STREAM_FLUSH_CHARS,
+        interval: float = STREAM_FLUSH_INTERVAL,
+    ):
+        self.file = file
+        self.size = size
+        self.interval = interval
+        self._parts: list[str] = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, s: str) -> None:
+        self._parts.append(s)
+        self._buffered += len(s)
+        if (
+            self._buffered >= self.size
+            or time.monotonic() - self._last_flush >= self.interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._parts:
+            self.file.write("".join(self._parts))
+            self._parts.clear()
+            self._buffered = 0
+        self.file.flush()
+        self._last_flush = time.monotonic()
 
 
 def _reply_stream(messages: list[Message], model: str) -> Message:
@@ -104,33 +271,42 @@ def _reply_stream(messages: list[Message], model: str) -> Message:
     def print_clear():
         print(" " * shutil.get_terminal_size().columns, end="\r")
 
-    output = ""
+    chunks: list[str] = []
+    n_chars = 0
+    detector = ToolUseDetector()
+    # written as-is, rich would interpret markup in the output
+    out = _OutputBuffer(sys.stdout)
     try:
-        for char in (char for chunk in _stream(messages, model) for char in chunk):
-            if not output:  # first character
+        for chunk in _stream(messages, model):
+            if not chunk:
+                continue
+            if not chunks:  # first chunk
                 print_clear()
                 print(f"{PROMPT_ASSISTANT}: ", end="")
-                
-            print(char, end="")
-            assert len(char) == 1
-            output += char
-
-            # need to flush stdout to get the print to show up
-            sys.stdout.flush()
 
             # pause inference on finished code-block, letting user run the command before continuing
-            tooluses = list(ToolUse.iter_from_content(output))
-            if tooluses and any(tooluse.is_runnable for tooluse in tooluses):
+            end = detector.feed(chunk)
+            if end is not None:
+                chunk = chunk[: end - n_chars]
+
+            out.write(chunk)
+            chunks.append(chunk)
+            n_chars += len(chunk)
+
+            if end is not None:
                 logger.debug("Found tool use, breaking")
                 break
     except KeyboardInterrupt:
-        return Message("assistant", output + "... ^C Interrupted")
+        return Message("assistant", "".join(chunks) + "... ^C Interrupted")
     finally:
+        out.flush()
         print_clear()
-    return Message("assistant", output)
+    return Message("assistant", "".join(chunks))
 
 
 def _client_to_provider() -> Provider:
+    if _provider:
+        return _provider
     openai_client = get_openai_client()
     anthropic_client = get_anthropic_client()
     groq_client = get_groq_client()
@@ -187,7 +363,8 @@ You have a comprehensive conversation log consisting of Linux commands and code
             f"Cannot summarize more than {context_limit} tokens, got {len_tokens(messages)}"
         )
 
-    summary = _chat_complete(messages, model)
+    with background():
+        summary = _chat_complete(messages, model)
     assert summary
     logger.debug(
         f"Summarized current conversation ({len_tokens(content)} -> {len_tokens(summary)} tokens): "
@@ -219,7 +396,8 @@ def _summarize_str(content: str) -> str:
             f"Cannot summarize more than {context_limit} tokens, got {len_tokens(messages)}"
         )
 
-    summary = _chat_complete(messages, model)
+    with background():
+        summary = _chat_complete(messages, model)
     assert summary
     logger.debug(
         f"Summarized long output ({len_tokens(content)} -> {len_tokens(summary)} tokens): "
@@ -255,7 +433,8 @@ IMPORTANT: output only the name, no preamble or postamble.
         + msgs
         + [Message("user", "Now, generate a name for this conversation.")]
     )
-    name = _chat_complete(msgs, model=get_summary_model(_client_to_provider())).strip()
+    with background():
+        name = _chat_complete(msgs, model=get_summary_model(_client_to_provider())).strip()
     return name
 
 
@@ -1,24 +1,28 @@
-from anthropic import Anthropic
-from collections.abc import Generator
+from anthropic import AsyncAnthropic
+from collections.abc import AsyncGenerator
 from typing import Literal, TypedDict
 from typing_extensions import Required
 
 from .constants import TEMPERATURE, TOP_P
 from .message import Message, len_tokens, msgs2dicts
+from .promptcache import cache_breakpoints, record_usage
+from .transport import get_http_client, get_http_config
 
-anthropic: Anthropic | None = None
+anthropic: AsyncAnthropic | None = None
 
 
 def init(config):
     global anthropic
     api_key = config.get_env_required("ANTHROPIC_API_KEY")
-    anthropic = Anthropic(
+    anthropic = AsyncAnthropic(
         api_key=api_key,
         max_retries=5,
+        http_client=get_http_client(),
+        timeout=get_http_config().timeout,
     )
 
 
-def get_client() -> Anthropic | None:
+def get_client() -> AsyncAnthropic | None:
     return anthropic
 
 class MessagePart(TypedDict, total=False):
@@ -28,11 +32,11 @@ class MessagePart(TypedDict, total=False):
     cache_control: dict[str, str]
 
 
-def chat(messages: list[Message], model: str) -> str:
+async def achat(messages: list[Message], model: str) -> str:
     assert anthropic, "LLM not initialized"
     messages, system_messages = _transform_system_messages(messages)
-    messages_dicts = msgs2dicts(messages, anthropic=True)
-    response = anthropic.beta.prompt_caching.messages.create(
+    messages_dicts = _cache_history(messages, msgs2dicts(messages, anthropic=True))
+    response = await anthropic.beta.prompt_caching.messages.create(
         model=model,
         messages=messages_dicts,  # type: ignore
         system=system_messages, # type: ignore
@@ -40,17 +44,18 @@ def chat(messages: list[Message], model: str) -> str:
         top_p=TOP_P,
         max_tokens=4096,
     )
+    _record_usage(response.usage)
     content = response.content
     assert content
     assert len(content) == 1
     return content[0].text  # type: ignore
 
 
-def stream(messages: list[Message], model: str) -> Generator[str, None, None]:
+async def astream(messages: list[Message], model: str) -> AsyncGenerator[str, None]:
     assert anthropic, "LLM not initialized"
     messages, system_messages = _transform_system_messages(messages)
-    messages_dicts = msgs2dicts(messages, anthropic=True)
-    with anthropic.beta.prompt_caching.messages.stream(
+    messages_dicts = _cache_history(messages, msgs2dicts(messages, anthropic=True))
+    async with anthropic.beta.prompt_caching.messages.stream(
         model=model,
         messages=messages_dicts,  # type: ignore
         system=system_messages, # type: ignore
@@ -58,7 +63,32 @@ def stream(messages: list[Message], model: str) -> Generator[str, None, None]:
         top_p=TOP_P,
         max_tokens=4096,
     ) as stream:
-        yield from stream.text_stream
+        async for text in stream.text_stream:
+            yield text
+        _record_usage((await stream.get_final_message()).usage)
+
+
+def _cache_history(messages: list[Message], messages_dicts: list[dict]) -> list[dict]:
+    # cache the conversation so far, besides the system prompt, with the remaining breakpoints (max 4)
+    for i in cache_breakpoints(messages, n=2):
+        *parts, last = messages_dicts[i]["content"]
+        messages_dicts[i] = {
+            **messages_dicts[i],
+            "content": [*parts, {**last, "cache_control": {"type": "ephemeral"}}],
+        }
+    return messages_dicts
+
+
+def _record_usage(usage) -> None:
+    # input_tokens doesn't include the tokens read from or written to the cache
+    cache_read = usage.cache_read_input_tokens or 0
+    cache_write = usage.cache_creation_input_tokens or 0
+    record_usage(
+        "anthropic",
+        usage.input_tokens + cache_read + cache_write,
+        cache_read=cache_read,
+        cache_write=cache_write,
+    )
 
 
 def _transform_system_messages(
@@ -67,6 +97,8 @@ def _transform_system_messages(
     # transform system messages into system kwarg for anthropic
     # for first system message, transform it into a system kwarg
     assert messages[0].role == "system"
+    # copied, the prepared messages are reused (like when falling back to another provider)
+    messages = list(messages)
     system_prompt = messages[0].content
     messages.pop(0)
 
@@ -1,47 +1,52 @@
 import logging
-from groq import Groq
-from collections.abc import Generator
+from groq import AsyncGroq
+from collections.abc import AsyncGenerator
 
 from .constants import TEMPERATURE, TOP_P
 from .message import Message, msgs2dicts
+from .promptcache import record_openai_usage
+from .transport import get_http_client, get_http_config
 
-groq: Groq | None = None
+groq: AsyncGroq | None = None
 logger = logging.getLogger(__name__)
 
 
 def init(config):
     global groq
     api_key = config.get_env_required("GROQ_API_KEY")
-    groq = Groq(
+    groq = AsyncGroq(
         api_key=api_key,
-        max_retries=5
+        max_retries=5,
+        http_client=get_http_client(),
+        timeout=get_http_config().timeout,
     )
 
 
-def get_client() -> Groq | None:
+def get_client() -> AsyncGroq | None:
     return groq
 
 
-def chat(messages: list[Message], model: str) -> str:
+async def achat(messages: list[Message], model: str) -> str:
     # This will generate code and such, so we need appropriate temperature and top_p params
     # top_p controls diversity, temperature controls randomness
     assert groq, "LLM not initialized"
-    response = groq.chat.completions.create(
+    response = await groq.chat.completions.create(
         model=model,
         messages=msgs2dicts(messages),  # type: ignore
         temperature=TEMPERATURE,
         top_p=TOP_P,
         max_tokens=4096,
     )
+    record_openai_usage("groq", response.usage)
     content = response.choices[0].message.content
     assert content
     return content
 
 
-def stream(messages: list[Message], model: str) -> Generator[str, None, None]:
+async def astream(messages: list[Message], model: str) -> AsyncGenerator[str, None]:
     assert groq, "LLM not initialized"
     stop_reason = None
-    for chunk in groq.chat.completions.create(
+    async for chunk in await groq.chat.completions.create(
         model=model,
         messages=msgs2dicts(messages),  # type: ignore
         temperature=TEMPERATURE,
@@ -52,6 +57,9 @@ def stream(messages: list[Message], model: str) -> Generator[str, None, None]:
         if not chunk.choices:  # type: ignore
             # Got a chunk with no choices, Azure always sends one of these at the start
             continue
+        if chunk.x_groq and chunk.x_groq.usage:
+            # the usage of a stream is sent with the last chunk
+            record_openai_usage("groq", chunk.x_groq.usage)
         stop_reason = chunk.choices[0].finish_reason  # type: ignore
         content = chunk.choices[0].delta.content  # type: ignore
         if content:
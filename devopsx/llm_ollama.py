@@ -1,47 +1,60 @@
 import logging
-from ollama import Client, Options
-from collections.abc import Generator
+from ollama import AsyncClient, Options
+from collections.abc import AsyncGenerator
 
 from .constants import TEMPERATURE, TOP_P
 from .message import Message, msgs2dicts
+from .transport import get_http_config, get_proxy_mounts, get_transport
 
-ollama_client: Client | None = None
+ollama_client: AsyncClient | None = None
 logger = logging.getLogger(__name__)
 
+# how long the model stays loaded after a request, so the next turn reuses the evaluated prompt
+KEEP_ALIVE = "30m"
+keep_alive: str | float = KEEP_ALIVE
+
 
 def init(config):
-    global ollama_client
+    global ollama_client, keep_alive
     ollama_host = config.get_env_required("OLLAMA_HOST")
-    ollama_client = Client(host=ollama_host, timeout=120)
+    keep_alive = config.get_env("OLLAMA_KEEP_ALIVE", KEEP_ALIVE)
+    ollama_client = AsyncClient(
+        host=ollama_host,
+        timeout=get_http_config().timeout,
+        transport=get_transport(),
+        mounts=get_proxy_mounts(),
+    )
 
 
-def get_client() -> Client | None:
+def get_client() -> AsyncClient | None:
     return ollama_client
 
 
-def chat(messages: list[Message], model: str) -> str:
+async def achat(messages: list[Message], model: str) -> str:
     assert ollama_client, "LLM not initialized"
-    response = ollama_client.chat(
+    response = await ollama_client.chat(
         model=model,
         messages=[messages[0].to_dict(keys=["role", "content"]), *msgs2dicts(messages[1:], ollama=True)],
         options=Options(
             temperature=TEMPERATURE,
             top_p=TOP_P
-        )
+        ),
+        keep_alive=keep_alive,
     )
     content = response['message']['content']
     assert content
     return content
 
 
-def stream(messages: list[Message], model: str) -> Generator[str, None, None]:
+async def astream(messages: list[Message], model: str) -> AsyncGenerator[str, None]:
     assert ollama_client, "LLM not initialized"
-    for chunk in ollama_client.chat(
+    async for chunk in await ollama_client.chat(
         model=model,
         messages=[messages[0].to_dict(keys=["role", "content"]), *msgs2dicts(messages[1:], ollama=True)],
         stream=True,
         options=Options(
             temperature=TEMPERATURE,
             top_p=TOP_P
-        )
-    ): yield chunk['message']['content']
\ No newline at end of file
+        ),
+        keep_alive=keep_alive,
+    ): yield chunk['message']['content']
@@ -1,42 +1,51 @@
 import logging
-from collections.abc import Generator
-from openai import AzureOpenAI, OpenAI
+from collections.abc import AsyncGenerator, Generator
+from openai import AsyncAzureOpenAI, AsyncOpenAI
 
 from .constants import TEMPERATURE, TOP_P
 from .message import Message, msgs2dicts
 from .models import ModelMeta, get_model
+from .promptcache import prompt_cache_key, record_openai_usage
+from .transport import get_http_client, get_http_config
 
-openai: OpenAI | None = None
+openai: AsyncOpenAI | None = None
+# which of the OpenAI-compatible providers the client is for
+provider: str | None = None
 logger = logging.getLogger(__name__)
 
 
 def init(llm: str, config):
-    global openai
+    global openai, provider
+    provider = llm
+    http_kwargs = {"http_client": get_http_client(), "timeout": get_http_config().timeout}
 
     if llm == "openai":
         api_key = config.get_env_required("OPENAI_API_KEY")
-        openai = OpenAI(api_key=api_key)
+        openai = AsyncOpenAI(api_key=api_key, **http_kwargs)
     elif llm == "azure":
         api_key = config.get_env_required("AZURE_OPENAI_API_KEY")
         azure_endpoint = config.get_env_required("AZURE_OPENAI_ENDPOINT")
-        openai = AzureOpenAI(
+        openai = AsyncAzureOpenAI(
             api_key=api_key,
             api_version="2023-07-01-preview",
             azure_endpoint=azure_endpoint,
+            **http_kwargs,
         )
     elif llm == "openrouter":
         api_key = config.get_env_required("OPENROUTER_API_KEY")
-        openai = OpenAI(api_key=api_key, base_url="https://openrouter.ai/api/v1")
+        openai = AsyncOpenAI(
+            api_key=api_key, base_url="https://openrouter.ai/api/v1", **http_kwargs
+        )
     elif llm == "local":
         api_base = config.get_env_required("OPENAI_API_BASE")
         api_key = config.get_env("OPENAI_API_KEY") or "ollama"
-        openai = OpenAI(api_key=api_key, base_url=api_base)
+        openai = AsyncOpenAI(api_key=api_key, base_url=api_base, **http_kwargs)
     else:
         raise ValueError(f"Unknown LLM: {llm}")
 
     assert openai, "LLM not initialized"
 
-def get_client() -> OpenAI | None:
+def get_client() -> AsyncOpenAI | None:
     return openai
 
 def _prep_o1(msgs: list[Message]) -> Generator[Message, None, None]:
@@ -49,52 +58,70 @@ def _prep_o1(msgs: list[Message]) -> Generator[Message, None, None]:
             )
         yield msg
 
-def chat(messages: list[Message], model: str) -> str:
+async def achat(messages: list[Message], model: str) -> str:
     # This will generate code and such, so we need appropriate temperature and top_p params
     # top_p controls diversity, temperature controls randomness
     assert openai, "LLM not initialized"
-    response = openai.chat.completions.create(
+    response = await openai.chat.completions.create(
         model=model,
-        messages=msgs2dicts(messages, openai=True),  # type: ignore
+        messages=msgs2dicts(messages, openai=True, model=model),  # type: ignore
         temperature=TEMPERATURE,
         top_p=TOP_P,
+        **_cache_kwargs(messages),
     )
+    record_openai_usage(provider or "openai", response.usage)
     content = response.choices[0].message.content
     assert content
     return content
 
-def reasoning_chat(messages: list[Message], model: str) -> str:
+async def areasoning_chat(messages: list[Message], model: str) -> str:
     assert openai, "LLM not initialized"
-    response = openai.chat.completions.create(
+    response = await openai.chat.completions.create(
         model=model,
-        messages=msgs2dicts(messages, openai=True),  # type: ignore
+        messages=msgs2dicts(messages, openai=True, model=model),  # type: ignore
         temperature=1,
         top_p=1,
         presence_penalty=0,
-        frequency_penalty=0
+        frequency_penalty=0,
+        **_cache_kwargs(messages),
     )
+    record_openai_usage(provider or "openai", response.usage)
     content = response.choices[0].message.content
     assert content
     return content
 
-def stream(messages: list[Message], model: str) -> Generator[str, None, None]:
+async def astream(messages: list[Message], model: str) -> AsyncGenerator[str, None]:
     assert openai, "LLM not initialized"
     stop_reason = None
-    for chunk in openai.chat.completions.create(
+    async for chunk in await openai.chat.completions.create(
         model=model,
-        messages=msgs2dicts(messages, openai=True),  # type: ignore
+        messages=msgs2dicts(messages, openai=True, model=model),  # type: ignore
         temperature=TEMPERATURE,
         top_p=TOP_P,
         stream=True,
         # the llama-cpp-python server needs this explicitly set, otherwise unreliable results
         # TODO: make this better
         max_tokens=1000 if not model.startswith("gpt-") else 4096,
+        **_cache_kwargs(messages, stream=True),
     ):
         if not chunk.choices:  # type: ignore
-            # Got a chunk with no choices, Azure always sends one of these at the start
+            # Got a chunk with no choices, Azure always sends one of these at the start,
+            # and with usage included, the last chunk has the usage
+            record_openai_usage(provider or "openai", chunk.usage)
             continue
         stop_reason = chunk.choices[0].finish_reason  # type: ignore
         content = chunk.choices[0].delta.content  # type: ignore
         if content:
             yield content
-    logger.debug(f"Stop reason: {stop_reason}")
\ No newline at end of file
+    logger.debug(f"Stop reason: {stop_reason}")
+
+
+def _cache_kwargs(messages: list[Message], stream: bool = False) -> dict:
+    # prefixes are cached automatically, these only work with the OpenAI API itself
+    if provider != "openai":
+        return {}
+    # sent as an extra parameter, older versions of the SDK don't know it
+    kwargs: dict = {"extra_body": {"prompt_cache_key": prompt_cache_key(messages)}}
+    if stream:
+        kwargs["stream_options"] = {"include_usage": True}
+    return kwargs
@@ -0,0 +1,145 @@
+"""
+Serialization of messages in conversation logs.
+
+Logs are stored as JSONL by default, one message per line.
+If `msgpack` is installed, logs can instead be stored in a compact binary format,
+by setting ``LOG_FORMAT=msgpack`` in the environment or config.
+If `orjson` is installed, it is used to speed up reading and writing JSONL.
+"""
+
+import json
+import logging
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass
+from collections.abc import Callable, Generator
+from typing import IO, Literal
+
+from .config import get_config
+from .message import Message
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+LogFormatName = Literal["jsonl", "msgpack"]
+
+
+def message_from_dict(d: dict) -> Message:
+    """Inverse of `Message.to_dict`."""
+    if files := d.pop("files", None):
+        d["files"] = [Path(f) for f in files]
+    if "timestamp" in d:
+        d["timestamp"] = datetime.fromisoformat(d["timestamp"])
+    return Message(**d)
+
+
+def _dumps_json(d: dict) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(d)
+        except TypeError:
+            # orjson is strict about str being valid UTF-8 (lone surrogates), json isn't
+            pass
+    return json.dumps(d).encode()
+
+
+def _loads_json(s: bytes) -> dict:
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # like escaped lone surrogates, written by `_dumps_json` with json
+            pass
+    return json.loads(s)
+
+
+def _dumps_jsonl(msg: Message) -> bytes:
+    return _dumps_json(msg.to_dict()) + b"\n"
+
+
+def _iter_jsonl(file: IO[bytes], path: str) -> Generator[Message, None, None]:
+    for line in file:
+        if not line.strip():
+            continue
+        if msg := parse_jsonl_line(line, path):
+            yield msg
+
+
+def parse_jsonl_line(line: bytes | str, path: str) -> Message | None:
+    try:
+        d = _loads_json(line.encode() if isinstance(line, str) else line)
+    except ValueError:
+        # likely a torn write from an interrupted append, dropped on next compaction
+        logger.warning(f"Skipping corrupt line in {path}: {line[:50]!r}")
+        return None
+    return message_from_dict(d)
+
+
+def _dumps_msgpack(msg: Message) -> bytes:
+    assert msgpack, "msgpack not installed"
+    return msgpack.packb(msg.to_dict())
+
+
+def _iter_msgpack(file: IO[bytes], path: str) -> Generator[Message, None, None]:
+    assert msgpack, "msgpack not installed"
+    # the unpacker stops at an incomplete trailing record, such as a torn append
+    unpacker = msgpack.Unpacker(file, raw=False)
+    try:
+        for d in unpacker:
+            yield message_from_dict(d)
+    except (ValueError, msgpack.UnpackException) as e:
+        logger.warning(f"Skipping corrupt data at end of {path}: {e}")
+
+
+@dataclass(frozen=True)
+class LogFormat:
+    """
+    A format for conversation logs.
+
+    Logs are a sequence of records, one per message, so they can be appended to.
+    """
+
+    name: LogFormatName
+    ext: str
+    dumps: Callable[[Message], bytes]
+    iter_loads: Callable[[IO[bytes], str], Generator[Message, None, None]]
+
+    @property
+    def available(self) -> bool:
+        return self.name != "msgpack" or msgpack is not None
+
+
+FORMATS: dict[str, LogFormat] = {
+    "jsonl": LogFormat("jsonl", ".jsonl", _dumps_jsonl, _iter_jsonl),
+    "msgpack": LogFormat("msgpack", ".msgpack", _dumps_msgpack, _iter_msgpack),
+}
+
+
+def get_format(name: str) -> LogFormat:
+    if name not in FORMATS:
+        raise ValueError(f"Unknown log format: {name}, available: {list(FORMATS)}")
+    fmt = FORMATS[name]
+    if not fmt.available:
+        raise ValueError(f"Log format {name} requires the {name} package to be installed")
+    return fmt
+
+
+def format_for_path(path: Path) -> LogFormat:
+    for fmt in FORMATS.values():
+        if path.suffix == fmt.ext:
+            return fmt
+    raise ValueError(f"Unknown log format for file: {path}")
+
+
+def get_default_format() -> LogFormat:
+    """Returns the format for new conversations, as configured with LOG_FORMAT."""
+    return get_format(get_config().get_env("LOG_FORMAT", "jsonl"))
@@ -1,21 +1,27 @@
+import os
 import json
+import hashlib
 import logging
 import shutil
+import sqlite3
 import textwrap
-from copy import copy
+from time import time
 from rich import print
 from pathlib import Path
-from datetime import datetime
+from collections import deque
 from dataclasses import dataclass
 from collections.abc import Generator
 from tempfile import TemporaryDirectory
 from itertools import islice, zip_longest
 from typing import Any, Literal, TypeAlias
 
+from . import catalog, logformat
+from .config import get_config
 from .dirs import get_logs_dir
-from .message import Message, len_tokens, print_msg
+from .message import Message, print_msg
+from .models import get_model
 from .prompts import get_prompt
-from .reduce import limit_log, reduce_log
+from .reduce import WINDOW_SLACK, ContextWindow
 
 PathLike: TypeAlias = str | Path
 
@@ -23,6 +29,29 @@ logger = logging.getLogger(__name__)
 
 RoleLiteral = Literal["user", "assistant", "system"]
 
+# when to fsync the conversation journal
+#  - always: after every appended message (durable, but slow on some filesystems)
+#  - never: leave it to the OS, the log is still compacted and synced on exit
+FsyncPolicy = Literal["always", "never"]
+
+
+@dataclass
+class Branch:
+    """
+    A branch of the conversation.
+
+    Stored as a fork of a parent branch plus its own tail, such that the messages
+    of the branch are ``parent[:fork] + tail``. Root branches (like main) have no parent.
+    This makes forking (e.g. backups on undo/edit) cost O(tail) in memory and on disk.
+    """
+
+    tail: list[Message]
+    parent: str | None = None
+    fork: int = 0
+
+    def __len__(self) -> int:
+        return self.fork + len(self.tail)
+
 
 class LogManager:
     """Manages a conversation log."""
@@ -33,8 +62,10 @@ class LogManager:
         logdir: PathLike | None = None,
         branch: str | None = None,
         show_hidden=False,
+        fsync: FsyncPolicy | None = None,
     ):
         self.current_branch = branch or "main"
+        self.fsync: FsyncPolicy = fsync or get_config().get_env("LOG_FSYNC", "never")  # type: ignore
 
         if logdir:
             self.logdir = Path(logdir)
@@ -44,34 +75,82 @@ class LogManager:
             logger.warning(f"No logfile specified, using tmpfile at {fpath}")
             self.logdir = Path(fpath)
         self.name = self.logdir.name
-
-        # load branches from adjacent files
-        self._branches = {self.current_branch: log or []}
-        if self.logdir / "conversation.jsonl":
-            _branch = "main"
-            if _branch not in self._branches:
-                self._branches[_branch] = _read_jsonl(
-                    self.logdir / "conversation.jsonl"
-                )
-        for file in self.logdir.glob("branches/*.jsonl"):
-            if file.name == self.logdir.name:
+        # the format of the log files, all branches of a conversation use the same format
+        self.format = _detect_format(self.logdir)
+
+        self._branches: dict[str, Branch] = {}
+        # number of tail messages of each branch known to be persisted on disk,
+        # used to append to the journal instead of rewriting the whole file
+        self._persisted: dict[str, int] = {}
+        # branches whose files are known to end with a complete record, safe to append to
+        self._intact: set[str] = set()
+        # branches modified in memory since they were last written
+        self._dirty: set[str] = set()
+        # content hash of the last persisted version of each branch
+        self._hashes: dict[str, str] = {}
+        # parent/fork metadata as last written to the branch index
+        self._index: dict[str, dict] = {}
+        # branches discovered on disk, but whose messages haven't been read yet
+        self._unloaded: set[str] = set()
+        # messages of the current branch as prepared for the LLM, built on first use
+        self._window: ContextWindow | None = None
+
+        # discover branches from adjacent files, they are read on first access
+        index_file = self.logdir / "branches" / "index.json"
+        if index_file.exists():
+            self._index = json.loads(index_file.read_text())
+        main_file = self._branch_path("main")
+        files = [main_file]
+        files += [
+            file
+            for file in self.logdir.glob(f"branches/*{self.format.ext}")
+            if file.name != self.logdir.name
+        ]
+        for file in files:
+            _branch = "main" if file == main_file else file.stem
+            if _branch in self._branches or not file.exists():
                 continue
-            _branch = file.stem
-            if _branch not in self._branches:
-                self._branches[_branch] = _read_jsonl(file)
+            meta = self._index.get(_branch, {})
+            self._branches[_branch] = Branch(
+                [], meta.get("parent"), meta.get("fork", 0)
+            )
+            self._unloaded.add(_branch)
+
+        if self.current_branch not in self._branches:
+            self._branches[self.current_branch] = Branch([])
+        for _branch, b in self._branches.items():
+            if b.parent is not None and b.parent not in self._branches:
+                logger.warning(f"Parent of branch '{_branch}' is missing, branch is incomplete")
+                b.parent, b.fork = None, 0
+
+        # if a log is given, it replaces the current branch
+        if log is not None:
+            # branches forked from it share its old messages, so they get a full copy of them
+            for _branch, b in self._branches.items():
+                if b.parent == self.current_branch:
+                    b.tail = self._materialize(_branch)
+                    b.parent, b.fork = None, 0
+                    self._persisted.pop(_branch, None)
+                    self._dirty.add(_branch)
+            self._branches[self.current_branch] = Branch(log)
+            self._unloaded.discard(self.current_branch)
+            self._persisted.pop(self.current_branch, None)
+
+        self._log = self._materialize(self.current_branch)
 
         self.show_hidden = show_hidden
         # TODO: Check if logfile has contents, then maybe load, or should it overwrite?
 
     @property
     def log(self) -> list[Message]:
-        return self._branches[self.current_branch]
+        return self._log
 
     @property
     def logfile(self) -> Path:
-        if self.current_branch == "main":
-            return get_logs_dir() / self.name / "conversation.jsonl"
-        return self.logdir / "branches" / f"{self.current_branch}.jsonl"
+        return self._branch_path(self.current_branch)
+
+    def _branch_path(self, branch: str) -> Path:
+        return _logfile(self.logdir, branch, self.format)
 
     def __getitem__(self, key):
         return self.log[key]
@@ -85,33 +164,199 @@ class LogManager:
     def __bool__(self):
         return bool(self.log)
 
+    def _get(self, branch: str) -> Branch:
+        """Returns a branch, reading its messages from disk on first access."""
+        b = self._branches[branch]
+        if branch in self._unloaded:
+            self._unloaded.discard(branch)
+            b.tail = _read_log(self._branch_path(branch))
+            self._persisted[branch] = len(b.tail)
+        return b
+
+    def _materialize(self, branch: str) -> list[Message]:
+        """Returns the full list of messages in a branch (the tail itself for root branches)."""
+        b = self._get(branch)
+        if b.parent is None:
+            return b.tail
+        return self._materialize(b.parent)[: b.fork] + b.tail
+
+    def _rebase_children(self, keep: int) -> None:
+        """
+        Rebases branches forked from the current branch after index `keep`,
+        by moving the messages they share beyond `keep` into their tails.
+
+        Must be called before the current branch is changed from index `keep` onwards.
+        """
+        for name, b in self._branches.items():
+            if b.parent == self.current_branch and b.fork > keep:
+                b = self._get(name)
+                b.tail = self.log[keep : b.fork] + b.tail
+                b.fork = keep
+                self._persisted.pop(name, None)
+                self._dirty.add(name)
+
+    def _pop(self) -> Message:
+        """Pops the last message of the current branch."""
+        self._rebase_children(len(self.log) - 1)
+        msg = self.log.pop()
+        self._update_window(len(self.log))
+        b = self._branches[self.current_branch]
+        if b.tail is not self.log:
+            if b.tail:
+                b.tail.pop()
+            else:
+                b.fork -= 1
+        self._persisted.pop(self.current_branch, None)
+        self._dirty.add(self.current_branch)
+        return msg
+
+    def _extend(self, msgs: list[Message]) -> None:
+        """Adds messages to the current branch, without writing them."""
+        b = self._branches[self.current_branch]
+        self.log.extend(msgs)
+        if b.tail is not self.log:
+            b.tail.extend(msgs)
+        self._update_window(len(self.log) - len(msgs))
+        self._dirty.add(self.current_branch)
+
     def append(self, msg: Message) -> None:
         """Appends a message to the log, writes the log, prints the message."""
+        b = self._branches[self.current_branch]
         self.log.append(msg)
-        self.write()
+        if b.tail is not self.log:
+            b.tail.append(msg)
+        self._update_window(len(self.log) - 1)
+        if self._persisted.get(self.current_branch) == len(b.tail) - 1 and self._is_intact(
+            self.current_branch
+        ):
+            # the rest of the log is already on disk, so just append to the journal
+            _append_log(self.logfile, msg, fsync=self.fsync == "always")
+            self._persisted[self.current_branch] += 1
+            # file no longer matches the last written version
+            self._hashes.pop(self.current_branch, None)
+            self._update_catalog()
+        else:
+            self._dirty.add(self.current_branch)
+            self.write()
         if not msg.quiet:
             print_msg(msg, oneline=False)
 
+    def _is_intact(self, branch: str) -> bool:
+        """Checks that the file of a branch doesn't end with a torn record, before appending to it."""
+        if branch not in self._intact:
+            path = self._branch_path(branch)
+            if self.format.name == "jsonl":
+                intact = _ends_with_newline(path)
+            else:
+                # records can't be told apart from the end, so compare with what was read
+                persisted = self._branches[branch].tail[: self._persisted[branch]]
+                intact = path.stat().st_size == len(_dumps_log(self.format, persisted))
+            if not intact:
+                logger.warning(f"Log file {path} ends with a torn record, rewriting it")
+                return False
+            self._intact.add(branch)
+        return True
+
     def write(self, branches=True) -> None:
         """
         Writes to the conversation log.
-        """
-        # create directory if it doesn't exist
-        Path(self.logfile).parent.mkdir(parents=True, exist_ok=True)
 
+        Rewrites the whole file(s), prefer `append()` for adding messages.
+        Other branches are only written if they changed since they were last written.
+        """
         # write current branch
-        _write_jsonl(self.logfile, self.log)
+        self._write_branch(self.current_branch)
 
         # write other branches
-        # FIXME: wont write main branch if on a different branch
         if branches:
-            branches_dir = self.logdir / "branches"
-            branches_dir.mkdir(parents=True, exist_ok=True)
-            for branch, msgs in self._branches.items():
-                if branch == "main":
-                    continue
-                branch_path = branches_dir / f"{branch}.jsonl"
-                _write_jsonl(branch_path, msgs)
+            for branch in list(self._dirty):
+                if branch != self.current_branch:
+                    self._write_branch(branch)
+
+        # write the parent/fork metadata of branches
+        index = {
+            name: {"parent": b.parent, "fork": b.fork}
+            for name, b in self._branches.items()
+            if b.parent is not None
+        }
+        if index != self._index:
+            index_file = self.logdir / "branches" / "index.json"
+            index_file.parent.mkdir(parents=True, exist_ok=True)
+            _write_file(index_file, json.dumps(index, indent=2).encode())
+            self._index = index
+
+        self._update_catalog()
+
+    def _update_catalog(self) -> None:
+        """Updates the entry of this conversation in the catalog, if it's in the logs dir."""
+        if self.logdir.parent != get_logs_dir():
+            return
+        name = self.logdir.name
+        try:
+            if "main" in self._branches and "main" not in self._unloaded:
+                main = self._branches["main"].tail
+                now = time()
+                catalog.update(
+                    catalog.Entry(
+                        name=name,
+                        path=str(self._branch_path("main")),
+                        created=main[0].timestamp.timestamp() if main else now,
+                        modified=now,
+                        messages=len(main),
+                        branches=len(self._branches),
+                    )
+                )
+            elif not catalog.touch(name, time(), len(self._branches)):
+                if entry := catalog.scan(self.logdir):
+                    catalog.update(entry)
+        except sqlite3.Error as e:
+            # the catalog can be rebuilt with /reindex, so don't fail the write
+            logger.warning(f"Failed to update conversation catalog: {e}")
+
+    def _write_branch(self, branch: str) -> None:
+        """Writes the tail of a branch, unless the file already has the same content."""
+        path = self._branch_path(branch)
+        tail = self._branches[branch].tail
+        data = _dumps_log(self.format, tail)
+        digest = hashlib.sha1(data).hexdigest()
+        if self._hashes.get(branch) != digest or not path.exists():
+            # create directory if it doesn't exist
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _write_file(path, data, fsync=self.fsync == "always")
+            self._hashes[branch] = digest
+        self._persisted[branch] = len(tail)
+        self._intact.add(branch)
+        self._dirty.discard(branch)
+
+    def compact(self) -> None:
+        """
+        Compacts the journal by rewriting all branches from memory, and syncs the current branch to disk.
+
+        Drops any torn lines left by an interrupted append, run on exit.
+        """
+        if not self.logdir.exists():
+            # conversation was removed, nothing to compact
+            return
+        # force a rewrite of the journal
+        self._hashes.pop(self.current_branch, None)
+        self.write()
+        _fsync_path(self.logfile)
+
+    def migrate(self, format: logformat.LogFormatName) -> None:
+        """Converts the log files of the conversation and all its branches to another format."""
+        fmt = logformat.get_format(format)
+        if fmt == self.format:
+            return
+        old_files = [self._branch_path(branch) for branch in self._branches]
+        for branch in self._branches:
+            self._get(branch)
+        self.format = fmt
+        self._hashes.clear()
+        self._dirty.update(self._branches)
+        self.write()
+        for file in old_files:
+            file.unlink(missing_ok=True)
+        logger.info(f"Migrated conversation {self.name} to {fmt.name}")
 
     def print(self, show_hidden: bool | None = None):
         print_msg(self.log, oneline=False, show_hidden=show_hidden or self.show_hidden)
@@ -120,20 +365,39 @@ class LogManager:
         """backup the current log to a new branch, usually before editing/undoing"""
         branch_prefix = f"{self.current_branch}-{type}-"
         n = len([b for b in self._branches.keys() if b.startswith(branch_prefix)])
-        self._branches[f"{branch_prefix}{n}"] = copy(self.log)
+        # forks off the current branch, the messages it shares are moved to it on change
+        self._branches[f"{branch_prefix}{n}"] = Branch(
+            [], parent=self.current_branch, fork=len(self.log)
+        )
+        self._dirty.add(f"{branch_prefix}{n}")
         self.write()
 
     def edit(self, new_log: list[Message]) -> None:
         """Edits the log."""
         self._save_backup_branch(type="edit")
-        self._branches[self.current_branch] = new_log
+        # find how many messages are unchanged
+        keep = 0
+        for msg1, msg2 in zip(self.log, new_log, strict=False):
+            if msg1 != msg2:
+                break
+            keep += 1
+        self._rebase_children(keep)
+        b = self._branches[self.current_branch]
+        if b.parent is None:
+            b.tail = new_log
+        else:
+            b.fork = min(b.fork, keep)
+            b.tail = new_log[b.fork :]
+        self._log = new_log
+        self._update_window(keep)
+        self._persisted.pop(self.current_branch, None)
         self.write()
 
     def undo(self, n: int = 1, quiet=False) -> None:
         """Removes the last message from the log."""
         undid = self[-1] if self.log else None
         if undid and undid.content.startswith("/undo"):
-            self.log.pop()
+            self._pop()
 
         # don't save backup branch if undoing a command
         if not self[-1].content.startswith("/"):
@@ -149,28 +413,40 @@ class LogManager:
         if not quiet:
             print("[yellow]Undoing messages:[/yellow]")
         for _ in range(n):
-            undid = self.log.pop()
+            undid = self._pop()
             if not quiet:
                 print(
                     f"[red]  {undid.role}: {textwrap.shorten(undid.content.strip(), width=50, placeholder='...')}[/]",
                 )
             peek = self[-1] if self.log else None
+        self.write()
 
     def prepare_messages(self) -> list[Message]:
-        """Prepares the log into messages before sending it to the LLM."""
-        msgs = self.log
-        msgs_reduced = list(reduce_log(msgs))
+        """
+        Prepares the log into messages before sending it to the LLM.
 
-        if len_tokens(msgs) != len_tokens(msgs_reduced):
-            logger.info(
-                f"Reduced log from {len_tokens(msgs)//1} to {len_tokens(msgs_reduced)//1} tokens"
-            )
-        msgs_limited = limit_log(msgs_reduced)
-        if len(msgs_reduced) != len(msgs_limited):
-            logger.info(
-                f"Limited log from {len(msgs_reduced)} to {len(msgs_limited)} messages"
+        The prepared messages are kept up to date as the log changes,
+        and only rebuilt from the whole log when the model changes.
+        Their prefix is kept the same across turns where possible, for providers to cache.
+        With ``REDUCE_SUMMARIZE=true``, old messages are summarized if truncating them isn't enough.
+        """
+        model = get_model()
+        if self._window is None or self._window.model != model:
+            summarize = get_config().get_env("REDUCE_SUMMARIZE", "false") in ["1", "true"]
+            self._window = ContextWindow(
+                model.context, model, summarize=summarize, slack=WINDOW_SLACK
             )
-        return msgs_limited
+            self._window.extend(self.log)
+        msgs = self._window.messages
+        if len(msgs) != len(self.log):
+            logger.info(f"Limited log from {len(self.log)} to {len(msgs)} messages")
+        return msgs
+
+    def _update_window(self, keep: int) -> None:
+        """Updates the prepared messages after the log changed from index `keep` onwards."""
+        if self._window is not None:
+            self._window.truncate(keep)
+            self._window.extend(self.log[keep:])
 
     @classmethod
     def load(
@@ -182,7 +458,7 @@ class LogManager:
         **kwargs,
     ) -> "LogManager":
         """Loads a conversation log."""
-        if str(logdir).endswith(".jsonl"):
+        if Path(logdir).suffix in (fmt.ext for fmt in logformat.FORMATS.values()):
             logdir = Path(logdir).parent
 
         logsdir = get_logs_dir()
@@ -192,31 +468,43 @@ class LogManager:
         else:
             logdir = Path(logdir)
 
-        if branch == "main":
-            logfile = logdir / "conversation.jsonl"
-        else:
-            logfile = logdir / f"branches/{branch}.jsonl"
-
-        if not Path(logfile).exists():
+        if not _find_logfile(logdir, branch):
+            logfile = _logfile(logdir, branch, _detect_format(logdir))
             if create:
                 logger.debug(f"Creating new logfile {logfile}")
-                Path(logfile).parent.mkdir(parents=True, exist_ok=True)
-                _write_jsonl(logfile, [])
+                logfile.parent.mkdir(parents=True, exist_ok=True)
+                _write_log(logfile, [])
             else:
                 raise FileNotFoundError(f"Could not find logfile {logfile}")
 
-        msgs = _read_jsonl(logfile)
-        if not msgs:
-            msgs = initial_msgs or [get_prompt()]
-        return cls(msgs, logdir=logdir, branch=branch, **kwargs)
+        log = cls(logdir=logdir, branch=branch, **kwargs)
+        if not log.log:
+            log._extend(initial_msgs or [get_prompt()])
+        return log
 
     def branch(self, name: str) -> None:
         """Switches to a branch."""
         self.write()
         if name not in self._branches:
             logger.info(f"Creating a new branch '{name}'")
-            self._branches[name] = copy(self.log)
+            self._branches[name] = Branch(
+                [], parent=self.current_branch, fork=len(self.log)
+            )
+            self._dirty.add(name)
         self.current_branch = name
+        self._log = self._materialize(name)
+        self._window = None
+
+    def _ancestry(self, branch: str) -> dict[str, int]:
+        """Returns the ancestors of a branch (including itself), with the length of the prefix shared with each."""
+        b = self._get(branch)
+        shared = {branch: len(b)}
+        n = len(b)
+        while b.parent is not None:
+            n = min(n, b.fork)
+            shared[b.parent] = n
+            b = self._get(b.parent)
+        return shared
 
     def diff(self, branch: str) -> str | None:
         """Prints the diff between the current branch and another branch."""
@@ -224,9 +512,18 @@ class LogManager:
             logger.warning(f"Branch '{branch}' does not exist.")
             return None
 
+        # find the divergence point from the nearest common ancestor
+        ours = self._ancestry(self.current_branch)
+        theirs = self._ancestry(branch)
+        diff_i = max(
+            (min(ours[b], theirs[b]) for b in ours.keys() & theirs.keys()), default=0
+        )
+
         # walk the log forwards until we find a message that is different
-        diff_i: int | None = None
-        for i, (msg1, msg2) in enumerate(zip_longest(self.log, self._branches[branch])):
+        log_other = self._materialize(branch)
+        for i, (msg1, msg2) in enumerate(
+            zip_longest(self.log[diff_i:], log_other[diff_i:]), start=diff_i
+        ):
             diff_i = i
             if msg1 != msg2:
                 break
@@ -239,7 +536,7 @@ class LogManager:
         diff = []
         for msg in self.log[diff_i:]:
             diff.append(f"+ {msg.format()}")
-        for msg in self._branches[branch][diff_i:]:
+        for msg in log_other[diff_i:]:
             diff.append(f"- {msg.format()}")
 
         if diff:
@@ -262,10 +559,13 @@ class LogManager:
         new_logdir = logsdir / name
         if new_logdir.exists():
             raise FileExistsError(f"Conversation {name} already exists.")
+        old_name = self.logdir.name
         self.name = name
         self.logdir.mkdir(parents=True, exist_ok=True)
         self.logdir.rename(logsdir / self.name)
         self.logdir = logsdir / self.name
+        catalog.remove(old_name)
+        self._update_catalog()
 
     def fork(self, name: str) -> None:
         """
@@ -285,19 +585,11 @@ class LogManager:
         }
         if branches:
             d["branches"] = {
-                branch: [msg.to_dict() for msg in msgs]
-                for branch, msgs in self._branches.items()
+                branch: [msg.to_dict() for msg in self._materialize(branch)]
+                for branch in self._branches
             }
         return d
 
-def _conversation_files() -> list[Path]:
-    # NOTE: only returns the main conversation, not branches (to avoid duplicates)
-    # returns the conversation files sorted by modified time (newest first)
-    logsdir = get_logs_dir()
-    return list(
-        sorted(logsdir.glob("*/conversation.jsonl"), key=lambda f: -f.stat().st_mtime)
-    )
-
 @dataclass(frozen=True)
 class Conversation:
     name: str
@@ -308,21 +600,20 @@ class Conversation:
     branches: int
 
 def get_conversations() -> Generator[Conversation, None, None]:
-    """Returns all conversations, excluding ones used for testing, evals, etc."""
-    for conv_fn in _conversation_files():
-        msgs = _read_jsonl(conv_fn, limit=1)
-        # TODO: can we avoid reading the entire file? maybe wont even be used, due to user convo filtering
-        len_msgs = conv_fn.read_text().count("}\n{")
-        assert len(msgs) <= 1
-        modified = conv_fn.stat().st_mtime
-        first_timestamp = msgs[0].timestamp.timestamp() if msgs else modified
+    """
+    Returns all conversations, most recently modified first.
+
+    Read from the catalog, which is synced with the conversations in the logs dir first.
+    """
+    catalog.sync()
+    for entry in catalog.get_entries():
         yield Conversation(
-            name=f"{conv_fn.parent.name}",
-            path=str(conv_fn),
-            created=first_timestamp,
-            modified=modified,
-            messages=len_msgs,
-            branches=1 + len(list(conv_fn.parent.glob("branches/*.jsonl"))),
+            name=entry.name,
+            path=entry.path,
+            created=entry.created,
+            modified=entry.modified,
+            messages=entry.messages,
+            branches=entry.branches,
         )
 
 def get_user_conversations() -> Generator[Conversation, None, None]:
@@ -334,22 +625,131 @@ def get_user_conversations() -> Generator[Conversation, None, None]:
             continue
         yield conv
 
-def _gen_read_jsonl(path: PathLike) -> Generator[Message, None, None]:
-    with open(path) as file:
-        for line in file.readlines():
-            json_data = json.loads(line)
-            files = [Path(f) for f in json_data.pop("files", [])]
-            if "timestamp" in json_data:
-                json_data["timestamp"] = datetime.fromisoformat(json_data["timestamp"])
-            yield Message(**json_data, files=files)
-
-def _read_jsonl(path: PathLike, limit=None) -> list[Message]:
-    gen = _gen_read_jsonl(path)
+def _detect_format(logdir: Path) -> logformat.LogFormat:
+    """Returns the format of an existing conversation, or the configured format for new ones."""
+    if main := _find_logfile(logdir):
+        return logformat.format_for_path(main)
+    return logformat.get_default_format()
+
+
+def _find_logfile(logdir: Path, branch: str = "main") -> Path | None:
+    """Returns the log file of a branch, in whichever format it was written."""
+    for fmt in logformat.FORMATS.values():
+        path = _logfile(logdir, branch, fmt)
+        if path.exists():
+            return path
+    return None
+
+
+def _logfile(logdir: Path, branch: str, fmt: logformat.LogFormat) -> Path:
+    if branch == "main":
+        return logdir / f"conversation{fmt.ext}"
+    return logdir / "branches" / f"{branch}{fmt.ext}"
+
+
+def _gen_read_log(path: PathLike) -> Generator[Message, None, None]:
+    """Reads messages lazily, only reading as much of the file as is consumed."""
+    fmt = logformat.format_for_path(Path(path))
+    with open(path, "rb") as file:
+        yield from fmt.iter_loads(file, str(path))
+
+
+def _gen_read_jsonl_reverse(
+    path: PathLike, block_size: int = 64 * 1024
+) -> Generator[Message, None, None]:
+    """Reads messages newest-first, by reading the file backwards from the end in blocks."""
+    with open(path, "rb") as file:
+        pos = file.seek(0, os.SEEK_END)
+        rest = b""
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            file.seek(pos)
+            lines = (file.read(size) + rest).split(b"\n")
+            # the first line might continue in the previous block
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip() and (msg := logformat.parse_jsonl_line(line, str(path))):
+                    yield msg
+        if rest.strip() and (msg := logformat.parse_jsonl_line(rest, str(path))):
+            yield msg
+
+
+def _read_log(path: PathLike, limit=None) -> list[Message]:
+    gen = _gen_read_log(path)
     if limit:
         gen = islice(gen, limit)  # type: ignore
     return list(gen)
 
-def _write_jsonl(path: PathLike, msgs: list[Message]) -> None:
-    with open(path, "w") as file:
-        for msg in msgs:
-            file.write(json.dumps(msg.to_dict()) + "\n")
\ No newline at end of file
+
+def _read_log_tail(path: PathLike, n: int) -> list[Message]:
+    """Reads the last `n` messages, without reading the rest of the file if it's JSONL."""
+    if Path(path).suffix == ".jsonl":
+        return list(reversed(list(islice(_gen_read_jsonl_reverse(path), n))))
+    # records in binary formats can't be found from the end, so stream through them
+    return list(deque(_gen_read_log(path), maxlen=n))
+
+
+def _count_log(path: PathLike) -> int:
+    """Counts the messages in a file."""
+    if Path(path).suffix == ".jsonl":
+        return _count_jsonl(path)
+    return sum(1 for _ in _gen_read_log(path))
+
+
+def _count_jsonl(path: PathLike, block_size: int = 1024 * 1024) -> int:
+    """Counts the messages in a JSONL file, skipping blank lines, without parsing them."""
+    count = 0
+    rest = b""
+    with open(path, "rb") as file:
+        while block := file.read(block_size):
+            lines = (rest + block).split(b"\n")
+            # the last line might continue in the next block
+            rest = lines.pop()
+            count += sum(1 for line in lines if line.strip())
+    # a trailing line without a newline might be a torn append, only counted if it parses
+    if rest.strip() and logformat.parse_jsonl_line(rest, str(path)):
+        count += 1
+    return count
+
+
+def _dumps_log(fmt: logformat.LogFormat, msgs: list[Message]) -> bytes:
+    return b"".join(fmt.dumps(msg) for msg in msgs)
+
+
+def _write_log(path: PathLike, msgs: list[Message]) -> None:
+    fmt = logformat.format_for_path(Path(path))
+    _write_file(path, _dumps_log(fmt, msgs))
+
+
+def _write_file(path: PathLike, data: bytes, fsync=False) -> None:
+    """Writes a file through a temporary file, so it's never left half-written."""
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, "wb") as file:
+        file.write(data)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+def _ends_with_newline(path: PathLike) -> bool:
+    with open(path, "rb") as file:
+        if file.seek(0, os.SEEK_END) == 0:
+            return True
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+def _append_log(path: PathLike, msg: Message, fsync=False) -> None:
+    fmt = logformat.format_for_path(Path(path))
+    with open(path, "ab") as file:
+        file.write(fmt.dumps(msg))
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def _fsync_path(path: PathLike) -> None:
+    with open(path, "rb") as file:
+        os.fsync(file.fileno())
@@ -8,15 +8,16 @@ import dataclasses
 from pathlib import Path
 from datetime import datetime
 from typing import Literal, Any
+from collections.abc import Iterable
 from typing_extensions import Self
-from dataclasses import dataclass, field
 from tomlkit._utils import escape_string
 
 from rich.syntax import Syntax
 
-from .models import get_model
+from .models import ModelMeta, get_model
 from .constants import ROLE_COLOR
-from .util import console, get_tokenizer, rich_to_str
+from .util import console, rich_to_str
+from .tokens import get_tokenizer
 from .codeblock import Codeblock
 
 logger = logging.getLogger(__name__)
@@ -26,7 +27,9 @@ logger = logging.getLogger(__name__)
 # maybe we should make it possible to store long outputs in files, and link/summarize it/preview it in the message
 max_system_len = 20000
 
-@dataclass(frozen=True, eq=False)
+# shared by all messages without files
+_NO_FILES: tuple[Path, ...] = ()
+
 class Message:
     """
     A message in the assistant conversation.
@@ -39,22 +42,73 @@ class Message:
                This is not persisted to the log file.
         timestamp: The timestamp of the message.
         files: Files attached to the message, could e.g. be images for vision.
+
+    Messages are immutable, and kept small since whole conversations are held in memory:
+    no instance dict, roles are interned, and the timestamp is stored as an epoch
+    and only converted to a datetime when accessed.
     """
 
+    __slots__ = ("role", "content", "pinned", "hide", "quiet", "_ts", "files")
+
     role: Literal["system", "user", "assistant"]
     content: str
-    pinned: bool = False
-    hide: bool = False
-    quiet: bool = False
-    timestamp: datetime = field(default_factory=datetime.now)
-    files: list[Path] = field(default_factory=list)
-
-    def __post_init__(self):
-        assert isinstance(self.timestamp, datetime)
+    pinned: bool
+    hide: bool
+    quiet: bool
+    # epoch for naive (local) timestamps, timezone-aware ones are kept as-is
+    _ts: float | datetime
+    files: tuple[Path, ...]
+
+    def __init__(
+        self,
+        role: Literal["system", "user", "assistant"],
+        content: str,
+        pinned: bool = False,
+        hide: bool = False,
+        quiet: bool = False,
+        timestamp: datetime | float | None = None,
+        files: Iterable[Path] = (),
+    ):
+        if timestamp is None:
+            # through datetime, so the epoch round-trips through isoformat exactly
+            timestamp = datetime.now().timestamp()
+        elif isinstance(timestamp, datetime):
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.timestamp()
+        else:
+            timestamp = float(timestamp)
+        _set = object.__setattr__
+        _set(self, "role", sys.intern(str(role)))
+        _set(self, "content", content)
+        _set(self, "pinned", pinned)
+        _set(self, "hide", hide)
+        _set(self, "quiet", quiet)
+        _set(self, "_ts", timestamp)
+        _set(self, "files", tuple(files) if files else _NO_FILES)
+
         if self.role == "system":
             if (length := len_tokens(self)) >= max_system_len:
                 logger.warning(f"System message too long: {length} tokens")
-        
+
+    @property
+    def timestamp(self) -> datetime:
+        if isinstance(self._ts, float):
+            return datetime.fromtimestamp(self._ts)
+        return self._ts
+
+    def __setattr__(self, name, value):
+        raise dataclasses.FrozenInstanceError(f"cannot assign to field {name!r}")
+
+    def __delattr__(self, name):
+        raise dataclasses.FrozenInstanceError(f"cannot delete field {name!r}")
+
+    def __reduce__(self):
+        # for pickle/copy, which would otherwise set the slots with setattr
+        return (
+            self.__class__,
+            (self.role, self.content, self.pinned, self.hide, self.quiet, self._ts, self.files),
+        )
+
     def __repr__(self):
         content = textwrap.shorten(self.content, 20, placeholder="...")
         return f"<Message role={self.role} content={content}>"
@@ -66,12 +120,25 @@ class Message:
         return (
             self.role == other.role
             and self.content == other.content
-            and self.timestamp == other.timestamp
+            and (
+                self._ts == other._ts
+                if type(self._ts) is type(other._ts)
+                else self.timestamp == other.timestamp
+            )
         )
 
     def replace(self, **kwargs) -> Self:
         """Replace attributes of the message."""
-        return dataclasses.replace(self, **kwargs)
+        fields = {
+            "role": self.role,
+            "content": self.content,
+            "pinned": self.pinned,
+            "hide": self.hide,
+            "quiet": self.quiet,
+            "timestamp": self._ts,
+            "files": self.files,
+        }
+        return self.__class__(**{**fields, **kwargs})
 
     def _content_files_list(
         self, openai: bool = False, anthropic: bool = False
@@ -126,8 +193,13 @@ class Message:
 
         return content
 
-    def to_dict(self, keys=None, openai=False, anthropic=False, ollama=False) -> dict:
-        """Return a dict representation of the message, serializable to JSON."""
+    def to_dict(self, keys=None, openai=False, anthropic=False) -> dict:
+        """
+        Return a dict representation of the message, serializable to JSON.
+
+        Without flags this is the storage format, which doesn't depend on the model.
+        Use `msgs2dicts` to encode messages for a request to a provider.
+        """
         content: str | list[dict[str, Any]]
         if anthropic or openai:
             # OpenAI format or Anthropic format should include files in the content
@@ -136,9 +208,8 @@ class Message:
             # storage/wire format should keep the content as a string
             content = self.content
 
-        model = get_model().model
         d: dict = {
-            "role": "user" if (ollama and self.role == "system") or (openai and model.startswith("o1-")) else self.role,
+            "role": self.role,
             "content": content,
             "timestamp": self.timestamp.isoformat(),
         }
@@ -317,19 +388,39 @@ def toml_to_msgs(toml: str) -> list[Message]:
     ]
 
 
-def msgs2dicts(msgs: list[Message], openai=False, anthropic=False, ollama=False) -> list[dict]:
-    """Convert a list of Message objects to a list of dicts ready to pass to an LLM."""
-    return [
-        msg.to_dict(keys=["role", "content"], openai=openai, anthropic=anthropic, ollama=ollama)
-        for msg in msgs
-    ]
-
+def msgs2dicts(
+    msgs: list[Message],
+    openai=False,
+    anthropic=False,
+    ollama=False,
+    model: str | None = None,
+) -> list[dict]:
+    """
+    Convert a list of Message objects to a list of dicts ready to pass to an LLM.
 
-# TODO: remove model assumption
-def len_tokens(content: str | Message | list[Message], model: str = "gpt-4") -> int:
-    """Get the number of tokens in a string, message, or list of messages."""
+    Provider-specific conversions are resolved once for the whole request,
+    for the given model (defaults to the current model).
+    """
+    if openai and model is None:
+        model = get_model().model
+    # ollama doesn't support the system role, and o1 models are sent all messages as user messages
+    all_as_user = openai and model is not None and model.startswith("o1-")
+    dicts = []
+    for msg in msgs:
+        d = msg.to_dict(keys=["role", "content"], openai=openai, anthropic=anthropic)
+        if all_as_user or (ollama and d["role"] == "system"):
+            d["role"] = "user"
+        dicts.append(d)
+    return dicts
+
+
+def len_tokens(
+    content: str | Message | list[Message], model: str | ModelMeta | None = None
+) -> int:
+    """Get the number of tokens in a string, message, or list of messages, for a model (defaults to the current model)."""
+    tokenizer = get_tokenizer(model)
     if isinstance(content, list):
-        return sum(len_tokens(msg.content, model) for msg in content)
+        return sum(tokenizer.count_batch([msg.content for msg in content]))
     if isinstance(content, Message):
-        return len_tokens(content.content, model)
-    return len(get_tokenizer(model).encode(content))
\ No newline at end of file
+        content = content.content
+    return tokenizer.count(content)
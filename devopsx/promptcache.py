@@ -0,0 +1,90 @@
+"""
+Prompt caching, so the long prefix a conversation resends every turn is read from the provider's cache.
+
+Providers cache the prefixes of recent requests, which only helps if the prefix stays
+byte-for-byte the same across turns. The prepared messages are kept stable by the context
+window (see `reduce.ContextWindow`), and each provider adapter makes use of the cache:
+
+- Anthropic caches up to blocks marked with ``cache_control``, see `cache_breakpoints`.
+- OpenAI caches prefixes automatically, `prompt_cache_key` sends a conversation to the same cache.
+- Ollama reuses the evaluated prompt while the model stays loaded, for ``OLLAMA_KEEP_ALIVE``.
+
+The cached input tokens reported by the providers are counted in `get_usage`.
+"""
+
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+from .message import Message
+
+logger = logging.getLogger(__name__)
+
+
+def cache_breakpoints(messages: list[Message], n: int = 2) -> list[int]:
+    """
+    Returns the indices of the last `n` user messages, to cache the prefix up to.
+
+    The last one caches the prefix for the next turn, and the one before it reads
+    the prefix cached by the previous turn.
+    """
+    indices = [i for i, msg in enumerate(messages) if msg.role == "user"]
+    return indices[-n:] if n else []
+
+
+def prompt_cache_key(messages: list[Message]) -> str:
+    """Identifies a conversation by its messages up to the first user message, which don't change."""
+    h = hashlib.sha256()
+    for msg in messages:
+        h.update(f"{msg.role}\0{msg.content}\0".encode(errors="surrogatepass"))
+        if msg.role == "user":
+            break
+    return h.hexdigest()[:32]
+
+
+@dataclass
+class CacheUsage:
+    requests: int = 0
+    # all input tokens, including the cached ones
+    input_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.cache_read_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+_usage: dict[str, CacheUsage] = {}
+_usage_lock = threading.Lock()
+
+
+def record_usage(
+    provider: str, input_tokens: int, cache_read: int = 0, cache_write: int = 0
+) -> None:
+    with _usage_lock:
+        usage = _usage.setdefault(provider, CacheUsage())
+        usage.requests += 1
+        usage.input_tokens += input_tokens
+        usage.cache_read_tokens += cache_read
+        usage.cache_write_tokens += cache_write
+    logger.debug(
+        f"Input tokens: {input_tokens} ({cache_read} cached, {cache_write} written to cache)"
+    )
+
+
+def record_openai_usage(provider: str, usage: Any) -> None:
+    """Records the usage reported by an OpenAI-compatible API, if any."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    record_usage(provider, usage.prompt_tokens, cache_read=cached)
+
+
+def get_usage() -> dict[str, CacheUsage]:
+    """Input tokens and cached input tokens by provider, for this session."""
+    with _usage_lock:
+        return {provider: CacheUsage(**vars(usage)) for provider, usage in _usage.items()}
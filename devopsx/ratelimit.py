@@ -0,0 +1,249 @@
+"""
+Client-side rate limits for provider requests.
+
+Budgets of requests and input tokens per minute are set per provider, or per model,
+in the ``[rate_limits]`` section of ``config.toml``, for example:
+
+.. code-block:: toml
+
+    [rate_limits.anthropic]
+    rpm = 50
+    tpm = 40000
+
+    [rate_limits."openai/gpt-4o"]
+    rpm = 500
+    tpm = 30000
+
+Requests over budget wait in a queue, instead of being sent to fail with a 429
+and retried with the SDK's backoff. Interactive requests are served before
+background ones, like summaries and conversation names (see `background`).
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import itertools
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from collections.abc import Callable, Generator
+from enum import IntEnum
+
+from .config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+# priority of the requests made in the current context
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "priority", default=Priority.INTERACTIVE
+)
+
+
+@contextmanager
+def background() -> Generator[None, None, None]:
+    """Makes the requests in this context wait for interactive ones."""
+    token = _priority.set(Priority.BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@dataclass(frozen=True)
+class Limits:
+    # requests per minute
+    rpm: float | None = None
+    # input tokens per minute
+    tpm: float | None = None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Limits":
+        names = {f.name for f in fields(cls)}
+        if unknown := set(d) - names:
+            logger.warning(f"Unknown keys in [rate_limits] config: {unknown}")
+        return cls(**{k: v for k, v in d.items() if k in names})
+
+
+class TokenBucket:
+    """Holds up to a minute's worth of a budget, refilled continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, n: float) -> float:
+        """Seconds until `n` is available, requests larger than the capacity wait for a full bucket."""
+        self._refill()
+        return max(0.0, (min(n, self.capacity) - self.level) / self.rate)
+
+    def take(self, n: float) -> None:
+        self._refill()
+        self.level -= min(n, self.capacity)
+
+
+@dataclass
+class QueueStats:
+    requests: int = 0
+    # requests waiting now, and the most that have waited at once
+    queued: int = 0
+    max_queued: int = 0
+    # seconds spent waiting, in total and for the longest wait
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "loop", "event")
+
+    def __init__(self, priority: Priority, seq: int):
+        self.priority = priority
+        self.seq = seq
+        # woken from other threads, if requests are made on several event loops
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self) -> None:
+        self.loop.call_soon_threadsafe(self.event.set)
+
+
+class _Queue:
+    """The budget for a provider or model, and the requests waiting for it."""
+
+    def __init__(self, limits: Limits):
+        self.requests = TokenBucket(limits.rpm) if limits.rpm else None
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        self.waiters: list[_Waiter] = []
+        self.stats = QueueStats()
+
+    def wait_time(self, tokens: int) -> float:
+        return max(
+            self.requests.wait_time(1) if self.requests else 0.0,
+            self.tokens.wait_time(tokens) if self.tokens else 0.0,
+        )
+
+    def take(self, tokens: int) -> None:
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+
+
+class RateLimiter:
+    """Makes requests wait for their budget, in order of priority, then arrival."""
+
+    def __init__(self, limits: dict[str, Limits] | None = None):
+        # by "provider" or "provider/model"
+        self.limits = limits or {}
+        self._queues: dict[str, _Queue] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _key(self, provider: str, model: str) -> str | None:
+        for key in (f"{provider}/{model}", provider):
+            if key in self.limits:
+                return key
+        return None
+
+    async def acquire(
+        self,
+        provider: str,
+        model: str,
+        tokens: int | Callable[[], int] = 0,
+        priority: Priority | None = None,
+    ) -> None:
+        """
+        Waits until a request with `tokens` input tokens fits the budget of its provider or model.
+
+        `tokens` can be a function, only called if there is a budget of tokens.
+        """
+        if (key := self._key(provider, model)) is None:
+            return
+        if callable(tokens):
+            tokens = tokens() if self.limits[key].tpm else 0
+        waiter = _Waiter(_priority.get() if priority is None else priority, next(self._seq))
+        with self._lock:
+            if key not in self._queues:
+                self._queues[key] = _Queue(self.limits[key])
+            queue = self._queues[key]
+            heapq.heappush(queue.waiters, waiter)
+            queue.stats.queued += 1
+            queue.stats.max_queued = max(queue.stats.max_queued, queue.stats.queued)
+
+        started = time.monotonic()
+        try:
+            while True:
+                waiter.event.clear()
+                with self._lock:
+                    delay = None
+                    if queue.waiters[0] is waiter:
+                        delay = queue.wait_time(tokens)
+                        if delay == 0:
+                            queue.take(tokens)
+                            heapq.heappop(queue.waiters)
+                            break
+                # the first in line waits for the budget, the others until they're first
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), delay)
+                except asyncio.TimeoutError:  # noqa: UP041, not the builtin on 3.10
+                    pass
+        except BaseException:
+            # cancelled while waiting, let the next in line go
+            with self._lock:
+                queue.waiters.remove(waiter)
+                heapq.heapify(queue.waiters)
+                queue.stats.queued -= 1
+                if queue.waiters:
+                    queue.waiters[0].wake()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            queue.stats.queued -= 1
+            queue.stats.requests += 1
+            queue.stats.wait_total += waited
+            queue.stats.wait_max = max(queue.stats.wait_max, waited)
+            if queue.waiters:
+                queue.waiters[0].wake()
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s for the rate limit of {key}")
+
+    def stats(self) -> dict[str, QueueStats]:
+        """Queue depth and wait times, by provider or model."""
+        with self._lock:
+            return {
+                key: QueueStats(**vars(queue.stats)) for key, queue in self._queues.items()
+            }
+
+
+_limiter: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Returns the rate limiter shared by all requests, with the configured limits."""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter(
+            {
+                key: Limits.from_dict(limits)
+                for key, limits in get_config().rate_limits.items()
+            }
+        )
+    return _limiter
@@ -2,23 +2,48 @@
 Tools to reduce a log to a smaller size.
 
 Typically used when the log exceeds a token limit and needs to be shortened.
+
+Old messages can also be replaced by a summary, which takes a request to the LLM,
+enabled for conversations with ``REDUCE_SUMMARIZE=true``.
 """
 
+import heapq
+import hashlib
 import logging
-from collections.abc import Generator
+import tempfile
+from pathlib import Path
+from collections.abc import Callable, Generator
 
-from .models import get_model
+from .models import ModelMeta, get_model
+from .codeblock import Codeblock
+from .dirs import get_cache_dir
 from .message import Message, len_tokens
 
 logger = logging.getLogger(__name__)
 
+# the latest messages are never summarized, as they are what the conversation is currently about
+SUMMARIZE_KEEP_LAST = 4
+# max tokens of messages summarized at once
+SUMMARIZE_SPAN_TOKENS = 16_000
+# approximate tokens of a summary, spans much shorter than this aren't worth summarizing
+SUMMARY_TOKENS = 500
+# fraction of the context freed at once when the prepared messages no longer fit,
+# so their prefix stays the same for providers to cache
+WINDOW_SLACK = 0.1
+
 
 def reduce_log(
     log: list[Message],
     limit=None,
-    prev_len=None,
+    summarize=False,
 ) -> Generator[Message, None, None]:
-    """Reduces log until it is below `limit` tokens by continually summarizing the longest messages until below the limit."""
+    """
+    Reduces log until it is below `limit` tokens by truncating the longest messages, longest first.
+    If that isn't enough and `summarize` is set, the oldest messages are summarized, see `summarize_span`.
+
+    Pinned messages are never reduced. Messages that can't be truncated are skipped,
+    and if none are left the log is returned as reduced as it got.
+    """
     # get the token limit
     if limit is None:
         limit = 0.9 * get_model().context
@@ -30,39 +55,46 @@ def reduce_log(
         return
 
     logger.info(f"Log exceeded limit of {limit}, was {tokens}, reducing")
-    # filter out pinned messages
-    i, longest_msg = max(
-        [(i, m) for i, m in enumerate(log) if not m.pinned],
-        key=lambda t: len_tokens(t[1].content),
-    )
-
-    # attempt to truncate the longest message
-    truncated = truncate_msg(longest_msg)
-
-    # if unchanged after truncate, attempt summarize
-    if truncated:
-        summary_msg = truncated
-    else:
-        # NOTE: disabled because buggy
-        # from . import summarize
-        # summary_msg = summarize(longest_msg, preamble=False)
-        # logger.info("Summary: %s", summary_msg.content)
-        # summary_msg.content = f"This {summary_msg.role} message was summarized due to length:\n{summary_msg.content}"
-        summary_msg = longest_msg
+    log = list(log)
+    # max-heap of the non-pinned messages by token count
+    heap = [(-len_tokens(m), i) for i, m in enumerate(log) if not m.pinned]
+    heapq.heapify(heap)
+    while tokens > limit and heap:
+        neg_tokens, i = heapq.heappop(heap)
 
-    log = log[:i] + [summary_msg] + log[i + 1 :]
+        # attempt to truncate the longest message
+        truncated = truncate_msg(log[i])
+        if truncated is None:
+            continue
 
-    tokens = len_tokens(log)
-    if tokens <= limit:
-        yield from log
-    else:
-        # recurse until we are below the limit
-        # but if prev_len == tokens, we are not making progress, so just return the log as-is
-        if prev_len == tokens:
-            logger.warning("Not making progress, returning log as-is")
-            yield from log
-        else:
-            yield from reduce_log(log, limit, prev_len=tokens)
+        # truncating again won't shorten it further, so it isn't pushed back
+        log[i] = truncated
+        tokens += len_tokens(truncated) + neg_tokens
+
+    if tokens > limit and summarize:
+        n_initial = _count_initial(log)
+        while tokens > limit:
+            span = _find_span(
+                log,
+                n_initial,
+                len(log) - SUMMARIZE_KEEP_LAST,
+                tokens - limit,
+                lambda i: len_tokens(log[i]),
+            )
+            if span is None:
+                break
+            a, b = span
+            try:
+                summary = summarize_span(log[a:b])
+            except Exception as e:
+                logger.warning(f"Failed to summarize messages: {e}")
+                break
+            tokens += len_tokens(summary) - len_tokens(log[a:b])
+            log[a:b] = [summary]
+
+    if tokens > limit:
+        logger.warning("Could not reduce log below the limit, returning it as-is")
+    yield from log
 
 
 def truncate_msg(msg: Message, lines_pre=10, lines_post=10) -> Message | None:
@@ -98,31 +130,262 @@ def truncate_msg(msg: Message, lines_pre=10, lines_post=10) -> Message | None:
         return None
 
 
-def limit_log(log: list[Message]) -> list[Message]:
+def summarize_span(msgs: list[Message]) -> Message:
+    """
+    Summarizes a span of messages into a single pinned system message.
+
+    Summaries are cached on disk by the roles and contents of the messages,
+    so summarizing the same span again (like when resuming a conversation) is free.
+    """
+    key = _span_key(msgs)
+    path = get_cache_dir() / "summaries" / f"{key}.txt"
+    if path.exists():
+        content = path.read_text()
+    else:
+        # noreorder
+        from .llm import summarize  # fmt: skip
+
+        logger.info(f"Summarizing {len(msgs)} messages")
+        content = summarize(msgs).content
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write atomically, so concurrent conversations never read a partial summary
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, suffix=".tmp", delete=False
+        ) as f:
+            f.write(content)
+        Path(f.name).replace(path)
+    return Message("system", content, pinned=True, timestamp=msgs[0].timestamp)
+
+
+def _span_key(msgs: list[Message]) -> str:
+    h = hashlib.sha256()
+    for msg in msgs:
+        h.update(f"{msg.role}\0{msg.content}\0".encode(errors="surrogatepass"))
+    return h.hexdigest()
+
+
+def _count_initial(log: list[Message]) -> int:
+    """Returns the number of leading system messages."""
+    return next((i for i, msg in enumerate(log) if msg.role != "system"), len(log))
+
+
+def _find_span(
+    msgs: list[Message],
+    start: int,
+    stop: int,
+    excess: float,
+    tokens: Callable[[int], int],
+    skip: Callable[[int], bool] = lambda i: False,
+) -> tuple[int, int] | None:
     """
-    Picks messages until the total number of tokens exceeds limit,
-    then removes the last message to get below the limit.
+    Finds the oldest span of messages in ``msgs[start:stop]`` worth summarizing, as a ``(start, end)`` range.
+
+    Spans are broken by pinned (and skipped) messages, and cover enough tokens
+    to remove `excess` tokens when replaced by a summary, up to `SUMMARIZE_SPAN_TOKENS`.
+    """
+    target = min(max(excess, SUMMARY_TOKENS) + SUMMARY_TOKENS, SUMMARIZE_SPAN_TOKENS)
+    a = start
+    while a < stop:
+        b, total = a, 0
+        while b < stop and total < target and not (msgs[b].pinned or skip(b)):
+            total += tokens(b)
+            b += 1
+        if total >= 2 * SUMMARY_TOKENS:
+            return a, b
+        a = max(b, a + 1)
+    return None
+
+
+def limit_log(log: list[Message], limit=None) -> tuple[list[Message], int]:
+    """
+    Picks messages latest-first until the total number of tokens exceeds `limit`,
+    leaving out the message that put it over the limit.
     Will always pick the first few system messages.
+
+    Returns the picked messages, and the index in `log` where the picked latest messages start.
     """
-    limit = get_model().context
+    if limit is None:
+        limit = get_model().context
 
     # Always pick the first system messages
-    initial_system_msgs = []
-    for msg in log:
-        if msg.role != "system":
-            break
-        initial_system_msgs.append(msg)
+    n_initial = _count_initial(log)
 
-    # Pick the messages in latest-first order
-    msgs = []
-    for msg in reversed(log[len(initial_system_msgs) :]):
-        msgs.append(msg)
-        if len_tokens(msgs) > limit:
+    # Pick the messages in latest-first order, with a running sum of their tokens
+    cut = len(log)
+    tokens = 0
+    while cut > n_initial:
+        tokens += len_tokens(log[cut - 1])
+        if tokens > limit:
             break
+        cut -= 1
+
+    return log[:n_initial] + log[cut:], cut
+
+
+class ContextWindow:
+    """
+    The reduced and limited view of a log that is sent to the LLM, maintained incrementally.
+
+    Like ``limit_log(list(reduce_log(log)))``, but updated in time proportional to the change
+    as messages are added and removed, instead of recomputing it from the whole log every turn.
+    Truncated messages stay truncated until they are removed, so which messages end up truncated
+    can differ from reducing the log from scratch.
+
+    With `summarize`, spans of old messages are replaced by their summary when truncating isn't enough.
+    A span is brought back if part of it is removed.
+
+    With `slack`, the window drops that fraction of the context at once when it's full,
+    instead of a message every turn, so the prefix stays the same (and cached by providers) for several turns.
+    """
+
+    def __init__(
+        self,
+        context: int,
+        model: ModelMeta | None = None,
+        summarize: bool = False,
+        slack: float = 0.0,
+    ):
+        self.context = context
+        # the model tokens are counted for, defaults to the current model
+        self.model = model
+        self.summarize = summarize
+        self.slack = slack
+        self.reduce_limit = 0.9 * context
+        # the reduced messages, one for each message in the log
+        self.msgs: list[Message] = []
+        self.tokens = 0
+        # leading system messages, always included
+        self.n_initial = 0
+        # start of the latest messages that fit in the context, and their tokens
+        self.start = 0
+        self.window_tokens = 0
+        # max-heap of candidates for truncation, entries may be stale
+        self._heap: list[tuple[int, int]] = []
+        # summarized spans by their start, as (end, summary), and the indices of their messages
+        self._spans: dict[int, tuple[int, Message]] = {}
+        self._folded: set[int] = set()
+
+    @property
+    def messages(self) -> list[Message]:
+        msgs = self.msgs[: self.n_initial]
+        if not self._spans:
+            return msgs + self.msgs[self.start :]
+        for i in range(self.start, len(self.msgs)):
+            if i in self._spans:
+                msgs.append(self._spans[i][1])
+            elif i not in self._folded:
+                msgs.append(self.msgs[i])
+        return msgs
+
+    def truncate(self, n: int) -> None:
+        """Removes the messages from index `n` onwards."""
+        if n >= len(self.msgs):
+            return
+        if any(end > n for end, _ in self._spans.values()):
+            # drop the summaries of (partly) removed spans, bringing back the rest of their messages
+            self._spans = {a: span for a, span in self._spans.items() if span[0] <= n}
+            self._folded = {i for a, (b, _) in self._spans.items() for i in range(a, b)}
+            del self.msgs[n:]
+            self.n_initial = min(self.n_initial, n)
+            self.start = min(self.start, n)
+            self._recount()
+            self._fit()
+            return
+        removed = len_tokens(self.msgs[n:], self.model)
+        self.tokens -= removed
+        if self.start >= n:
+            self.start, self.window_tokens = n, 0
+        else:
+            self.window_tokens -= removed
+        self.n_initial = min(self.n_initial, n)
+        del self.msgs[n:]
+        self._fit()
+
+    def extend(self, msgs: list[Message]) -> None:
+        """Adds messages to the end."""
+        for msg in msgs:
+            i = len(self.msgs)
+            self.msgs.append(msg)
+            tokens = len_tokens(msg, self.model)
+            self.tokens += tokens
+            if self.n_initial == i and msg.role == "system":
+                self.n_initial = self.start = i + 1
+            else:
+                self.window_tokens += tokens
+            if not msg.pinned:
+                heapq.heappush(self._heap, (-tokens, i))
+        self._reduce()
+        self._fit()
+
+    def _reduce(self) -> None:
+        """Truncates the longest messages until below the reduce limit, like `reduce_log`."""
+        if self.tokens > self.reduce_limit and self._heap:
+            logger.info(f"Log exceeded limit of {self.reduce_limit}, was {self.tokens}, reducing")
+        while self.tokens > self.reduce_limit and self._heap:
+            _, i = heapq.heappop(self._heap)
+            # skip entries of messages that have since been removed
+            if i >= len(self.msgs) or self.msgs[i].pinned or i in self._folded:
+                continue
+            truncated = truncate_msg(self.msgs[i])
+            if truncated is None:
+                continue
+            diff = len_tokens(truncated, self.model)
+            diff -= len_tokens(self.msgs[i], self.model)
+            self.msgs[i] = truncated
+            self.tokens += diff
+            if i >= self.start:
+                self.window_tokens += diff
+        if self.tokens > self.reduce_limit and self.summarize:
+            self._summarize()
+
+    def _summarize(self) -> None:
+        """Summarizes the oldest spans of messages until below the reduce limit, like `reduce_log`."""
+        while self.tokens > self.reduce_limit:
+            span = _find_span(
+                self.msgs,
+                self.n_initial,
+                len(self.msgs) - SUMMARIZE_KEEP_LAST,
+                self.tokens - self.reduce_limit,
+                self._tokens,
+                self._folded.__contains__,
+            )
+            if span is None:
+                return
+            a, b = span
+            try:
+                summary = summarize_span(self.msgs[a:b])
+            except Exception as e:
+                # don't retry every turn
+                logger.warning(f"Failed to summarize messages, disabling summaries: {e}")
+                self.summarize = False
+                return
+            self._spans[a] = (b, summary)
+            self._folded.update(range(a, b))
+            self._recount()
+
+    def _tokens(self, i: int) -> int:
+        """Returns the tokens message `i` takes up in the window, summarized messages count as their summary."""
+        if i in self._folded:
+            span = self._spans.get(i)
+            return len_tokens(span[1], self.model) if span else 0
+        return len_tokens(self.msgs[i], self.model)
 
-    # Remove the message that put us over the limit
-    if len_tokens(msgs) > limit:
-        # skip the last message
-        msgs.pop()
+    def _recount(self) -> None:
+        tokens = [self._tokens(i) for i in range(len(self.msgs))]
+        self.tokens = sum(tokens)
+        self.window_tokens = sum(tokens[self.start :])
 
-    return initial_system_msgs + list(reversed(msgs))
+    def _fit(self) -> None:
+        """Moves the start of the window to include as many of the latest messages as fit, like `limit_log`."""
+        # when full, the window is moved to leave the slack free, and only grows back up to it
+        limit = self.context * (1 - self.slack)
+        while self.start > self.n_initial:
+            tokens = self._tokens(self.start - 1)
+            if self.window_tokens + tokens > limit:
+                break
+            self.start -= 1
+            self.window_tokens += tokens
+        if self.window_tokens > self.context:
+            while self.window_tokens > limit:
+                self.window_tokens -= self._tokens(self.start)
+                self.start += 1
@@ -0,0 +1,212 @@
+"""
+Routing requests over several LLM providers.
+
+A request is sent to the first of its routes (provider and model), and falls back
+to the next route if it fails before the first token arrives. With hedging,
+if the first token takes longer than `hedge_after` seconds, the request is also sent
+to the next route, and whichever is slower to respond is cancelled.
+
+Routes are tried in the configured order, except that providers with many recent
+errors are tried last, and providers that have responded faster are tried first.
+"""
+
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TypeVar
+
+from .message import Message
+
+logger = logging.getLogger(__name__)
+
+# weight of a new sample in the moving averages
+EWMA_ALPHA = 0.3
+# seconds for the error rate to halve when there are no new errors, so failed providers get retried
+ERROR_HALF_LIFE = 300.0
+# providers with an error rate above this are tried last
+UNHEALTHY_ERROR_RATE = 0.5
+
+T = TypeVar("T")
+
+ChatFunc = Callable[[list[Message], str, str], Awaitable[str]]
+StreamFunc = Callable[[list[Message], str, str], AsyncIterator[str]]
+
+
+@dataclass(frozen=True)
+class Route:
+    provider: str
+    model: str
+
+    def __str__(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+    @classmethod
+    def parse(cls, s: str) -> "Route":
+        """Parses a route like ``anthropic/claude-3-5-sonnet-20240620``."""
+        provider, sep, model = s.strip().partition("/")
+        if not sep or not model:
+            raise ValueError(f"Invalid route, expected provider/model: {s}")
+        return cls(provider, model)
+
+
+class RouteStats:
+    """Moving averages of a provider's time to first token, and of its error rate."""
+
+    def __init__(self):
+        self.latency: float | None = None
+        self._errors = 0.0
+        self._updated = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        elapsed = time.monotonic() - self._updated
+        return self._errors * 0.5 ** (elapsed / ERROR_HALF_LIFE)
+
+    def record(self, latency: float | None = None, error: bool = False) -> None:
+        """Records a request that got its first token after `latency` seconds, or failed."""
+        self._errors = self.error_rate * (1 - EWMA_ALPHA) + EWMA_ALPHA * error
+        self._updated = time.monotonic()
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = self.latency * (1 - EWMA_ALPHA) + EWMA_ALPHA * latency
+
+
+class Router:
+    """Sends requests over routes in order of preference, with fallback and optional hedging."""
+
+    def __init__(
+        self,
+        chat: ChatFunc,
+        stream: StreamFunc,
+        fallbacks: list[Route] | None = None,
+        hedge_after: float | None = None,
+    ):
+        self.chat = chat
+        self.stream = stream
+        self.fallbacks = fallbacks or []
+        self.hedge_after = hedge_after
+        self.stats: dict[str, RouteStats] = {}
+
+    def order(self, routes: list[Route]) -> list[Route]:
+        """Orders routes by preference, healthy and fast providers first, otherwise as given."""
+
+        def key(item: tuple[int, Route]):
+            i, route = item
+            stats = self.stats.get(route.provider)
+            if stats is None:
+                return (False, float("inf"), i)
+            unhealthy = stats.error_rate > UNHEALTHY_ERROR_RATE
+            latency = float("inf") if stats.latency is None else stats.latency
+            return (unhealthy, latency, i)
+
+        return [route for _, route in sorted(enumerate(routes), key=key)]
+
+    def _record(self, route: Route, latency: float | None = None, error: bool = False):
+        self.stats.setdefault(route.provider, RouteStats()).record(latency, error)
+
+    async def achat(self, messages: list[Message], routes: list[Route]) -> str:
+        async def attempt(route: Route) -> str:
+            return await self.chat(messages, route.model, route.provider)
+
+        _, content = await self._race(routes, attempt)
+        return content
+
+    async def astream(
+        self, messages: list[Message], routes: list[Route]
+    ) -> AsyncIterator[str]:
+        async def attempt(route: Route) -> tuple[str, AsyncIterator[str]]:
+            stream = self.stream(messages, route.model, route.provider)
+            try:
+                return await stream.__anext__(), stream
+            except StopAsyncIteration:
+                return "", stream
+
+        async def close(result: tuple[str, AsyncIterator[str]]) -> None:
+            await _aclose(result[1])
+
+        route, (first, stream) = await self._race(routes, attempt, close)
+        try:
+            if first:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        except Exception:
+            self._record(route, error=True)
+            raise
+        finally:
+            await _aclose(stream)
+
+    async def _race(
+        self,
+        routes: list[Route],
+        attempt: Callable[[Route], Awaitable[T]],
+        close: Callable[[T], Awaitable[None]] | None = None,
+    ) -> tuple[Route, T]:
+        """
+        Runs `attempt` on the routes in order of preference until one succeeds.
+
+        With hedging, the next route is also started if no attempt has succeeded after `hedge_after`,
+        and the attempts that lose are cancelled (or closed with `close`, if they succeeded too).
+        """
+        routes = self.order(routes)
+        pending: dict[asyncio.Future, tuple[Route, float]] = {}
+        n_started = 0
+        error: BaseException | None = None
+
+        def start_next():
+            nonlocal n_started
+            route = routes[n_started]
+            n_started += 1
+            pending[asyncio.ensure_future(attempt(route))] = (route, time.monotonic())
+
+        start_next()
+        winner: tuple[Route, T] | None = None
+        try:
+            while pending and winner is None:
+                can_hedge = self.hedge_after is not None and n_started < len(routes)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_after if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    logger.info(
+                        f"No response after {self.hedge_after}s, also trying {routes[n_started]}"
+                    )
+                    start_next()
+                    continue
+                for task in done:
+                    route, started = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        logger.warning(f"Request to {route} failed: {error}")
+                        self._record(route, error=True)
+                    elif winner is None:
+                        self._record(route, latency=time.monotonic() - started)
+                        winner = route, task.result()
+                    elif close:
+                        # finished at the same time as the winner
+                        await close(task.result())
+                if winner is None and not pending and n_started < len(routes):
+                    logger.info(f"Falling back to {routes[n_started]}")
+                    start_next()
+        finally:
+            # cancel the losers (or everything, if cancelled ourselves)
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if close and not isinstance(result, BaseException):
+                    await close(result)
+        if winner is None:
+            assert error is not None
+            raise error
+        return winner
+
+
+async def _aclose(stream: AsyncIterator) -> None:
+    if aclose := getattr(stream, "aclose", None):
+        await aclose()
@@ -2,7 +2,6 @@ import io
 import os
 import click
 import logging
-from pathlib import Path
 from contextlib import redirect_stdout
 
 from ..llm import reply
@@ -48,14 +47,10 @@ def main(verbose: bool, model: str | None, name: str, prompt: str):  # pragma: n
     # print(*prev_conv_files, sep="\n")
     if not logdir:
         logdir = get_name(name)
-        Path(logdir).mkdir(exist_ok=True)
-        logfile = Path(logdir) / "conversation.jsonl"
-        logfile.touch()
-        log = LogManager.load(logfile)
+        log = LogManager.load(logdir, create=True)
     else:
         initial_msgs = [get_prompt("full")]
-        logfile = Path(logdir) / "conversation.jsonl"
-        log = LogManager.load(logfile, initial_msgs=initial_msgs, show_hidden=True)
+        log = LogManager.load(logdir, initial_msgs=initial_msgs, show_hidden=True)
 
     prompt_msg = Message("user", prompt.strip())
     msg = _include_paths(prompt_msg)
@@ -0,0 +1,223 @@
+"""
+Tokenizers for counting and truncating by tokens, per model.
+
+OpenAI models get their exact tiktoken encoding. Other providers don't ship their
+tokenizers locally, so their tokens are estimated from the number of characters.
+Tokenizers are created once per model (and encoders once per process),
+and token counts are cached by content.
+
+Encoders are loaded in the background on init, see `warmup()`, and can be loaded
+from a local directory on hosts without internet access with ``TOKENIZER_DIR``.
+"""
+
+import os
+import math
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from functools import lru_cache
+from collections import OrderedDict
+
+import tiktoken
+
+from . import models
+from .models import ModelMeta, get_model
+
+logger = logging.getLogger(__name__)
+
+# approximate characters per token for providers without a local tokenizer,
+# averaged over English text and code, so budget with some margin
+CHARS_PER_TOKEN: dict[str, float] = {
+    "anthropic": 3.5,
+    "google": 4.0,
+    "groq": 4.0,
+    "local": 4.0,
+}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# used when no model is given and no default model is set
+FALLBACK_MODEL = "openai/gpt-4"
+
+# max number of cached token counts
+COUNT_CACHE_SIZE = 8192
+
+# where tiktoken downloads the encoding files from
+ENCODINGS_URL = "https://openaipublic.blob.core.windows.net/encodings"
+
+
+class Tokenizer:
+    """
+    Counts tokens for a model, exactly with a local encoding,
+    or estimated from the number of characters if there is none.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        encoding: tiktoken.Encoding | None = None,
+        chars_per_token: float = DEFAULT_CHARS_PER_TOKEN,
+    ):
+        self.name = name
+        self.encoding = encoding
+        self.chars_per_token = chars_per_token
+        # LRU cache of token counts by content, so counting a growing log only encodes new messages
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<Tokenizer {self.name}>"
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """Counts the tokens of several texts, encoding the ones not in the cache as a batch."""
+        if self.encoding is None:
+            return [math.ceil(len(text) / self.chars_per_token) for text in texts]
+        with self._lock:
+            counts = [self._counts.get(text) for text in texts]
+            for text, count in zip(texts, counts, strict=True):
+                if count is not None:
+                    self._counts.move_to_end(text)
+        missing = list({text for text, count in zip(texts, counts, strict=True) if count is None})
+        if not missing:
+            return counts  # type: ignore
+        new_counts = dict(zip(missing, map(len, self.encode_batch(missing)), strict=True))
+        with self._lock:
+            self._counts.update(new_counts)
+            while len(self._counts) > COUNT_CACHE_SIZE:
+                self._counts.popitem(last=False)
+        return [new_counts[t] if c is None else c for t, c in zip(texts, counts, strict=True)]
+
+    def encode(self, text: str) -> list[int]:
+        return self._get_encoding().encode(text, disallowed_special=())
+
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        """Encodes several texts, in parallel threads for large batches."""
+        return self._get_encoding().encode_batch(texts, disallowed_special=())
+
+    def decode(self, tokens: list[int]) -> str:
+        return self._get_encoding().decode(tokens)
+
+    def split(self, text: str, pre_tokens: int, post_tokens: int) -> tuple[str, str] | None:
+        """Returns the first `pre_tokens` and last `post_tokens` tokens of the text, or None if it's not longer than that."""
+        if self.encoding is None:
+            pre_chars = int(pre_tokens * self.chars_per_token)
+            post_chars = int(post_tokens * self.chars_per_token)
+            if len(text) <= pre_chars + post_chars:
+                return None
+            return text[:pre_chars], text[len(text) - post_chars :]
+        tokens = self.encode(text)
+        if len(tokens) <= pre_tokens + post_tokens:
+            return None
+        return self.decode(tokens[:pre_tokens]), self.decode(tokens[len(tokens) - post_tokens :])
+
+    def _get_encoding(self) -> tiktoken.Encoding:
+        if self.encoding is None:
+            raise ValueError(f"Tokenizer {self.name} only estimates token counts")
+        return self.encoding
+
+
+# tokenizers by model, and tokenizers with an exact encoding by encoding name,
+# so models with the same encoding share the encoder and the count cache
+_tokenizers: dict[ModelMeta, Tokenizer] = {}
+_exact_tokenizers: dict[str, Tokenizer] = {}
+_registry_lock = threading.RLock()
+
+
+def get_tokenizer(model: str | ModelMeta | None = None) -> Tokenizer:
+    """Returns the tokenizer for a model, defaults to the current model."""
+    if model is None:
+        model = models.DEFAULT_MODEL or FALLBACK_MODEL
+    if isinstance(model, str):
+        model = _get_model(model)
+    # fast path without the lock, tokenizers are never removed
+    if tokenizer := _tokenizers.get(model):
+        return tokenizer
+    with _registry_lock:
+        if model not in _tokenizers:
+            _tokenizers[model] = _create_tokenizer(model)
+        return _tokenizers[model]
+
+
+@lru_cache
+def _get_model(model: str) -> ModelMeta:
+    # cached to only warn once about unknown models
+    return get_model(model)
+
+
+def _create_tokenizer(model: ModelMeta) -> Tokenizer:
+    name = model.model.removeprefix("openai/")
+    if model.provider in ["openai", "azure"] or model.model.startswith("openai/"):
+        encoding = _get_openai_encoding(name)
+    elif model.provider == "unknown" and name.startswith(("gpt-", "o1-")):
+        encoding = _get_openai_encoding(name)
+    else:
+        ratio = CHARS_PER_TOKEN.get(model.provider, DEFAULT_CHARS_PER_TOKEN)
+        return Tokenizer(f"{model.provider}-estimate", chars_per_token=ratio)
+    if encoding.name not in _exact_tokenizers:
+        _exact_tokenizers[encoding.name] = Tokenizer(encoding.name, encoding)
+    return _exact_tokenizers[encoding.name]
+
+
+def _get_openai_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # models newer than the installed tiktoken
+        encoding = "o200k_base" if model.startswith(("gpt-4o", "o1-")) else "cl100k_base"
+        logger.debug(f"No tiktoken encoding known for {model}, using {encoding}")
+        return tiktoken.get_encoding(encoding)
+
+
+def warmup(model: str | ModelMeta | None = None) -> threading.Thread:
+    """
+    Loads the tokenizer for a model in a background thread, defaults to the current model.
+
+    Loading an encoding takes a while (and a download, if not cached yet),
+    so this is started on init to not delay the first turn.
+    """
+
+    def _warmup():
+        try:
+            get_tokenizer(model).count("")
+        except Exception as e:
+            # counting will retry, and raise, on first use
+            logger.warning(f"Failed to load tokenizer: {e}")
+
+    thread = threading.Thread(target=_warmup, name="tokenizer-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def preload_encodings(path: Path) -> list[str]:
+    """
+    Makes the tiktoken encoding files in a directory (like ``cl100k_base.tiktoken``) available offline.
+
+    tiktoken downloads encodings on first use, which fails on hosts without internet access.
+    The files are copied into tiktoken's download cache, where it looks for them first
+    (and verifies their hashes). Returns the names of the preloaded encodings.
+    """
+    # same location and cache keys as tiktoken.load.read_file_cached
+    cache_dir = Path(
+        os.environ.get("TIKTOKEN_CACHE_DIR")
+        or os.environ.get("DATA_GYM_CACHE_DIR")
+        or Path(tempfile.gettempdir()) / "data-gym-cache"
+    )
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for file in sorted(path.glob("*.tiktoken")):
+        url = f"{ENCODINGS_URL}/{file.name}"
+        cached = cache_dir / hashlib.sha1(url.encode()).hexdigest()
+        if not cached.exists():
+            shutil.copyfile(file, cached)
+        names.append(file.stem)
+    logger.debug(f"Preloaded tiktoken encodings from {path}: {names}")
+    return names
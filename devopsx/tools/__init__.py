@@ -2,7 +2,7 @@ import logging
 from functools import lru_cache
 from collections.abc import Generator
 
-from .base import ToolSpec, ToolUse
+from .base import ToolSpec, ToolUse, ToolUseDetector
 from .browser import tool as browser_tool
 from .gh import tool as gh_tool
 from ..message import Message
@@ -26,6 +26,7 @@ logger = logging.getLogger(__name__)
 __all__ = [
     "ToolSpec",
     "ToolUse",
+    "ToolUseDetector",
     "all_tools",
     "execute_msg",
 ]
@@ -176,6 +176,8 @@ class ToolUse:
             parser = etree.HTMLParser()
             tree = etree.fromstring(content, parser)
 
+            # tool uses are found in order, so each is searched for after the previous one
+            pos = 0
             for tooluse in tree.xpath("//tool-use"):
                 for child in tooluse.getchildren():
                     tool_name = child.tag
@@ -183,7 +185,8 @@ class ToolUse:
                     tool_content = (child.text or "").strip()
 
                     # Find the start position of the tool in the original content
-                    start_pos = content.find(f"<{tool_name}")
+                    start_pos = content.find(f"<{tool_name}", pos)
+                    pos = start_pos + 1
 
                     yield ToolUse(
                         tool_name,
@@ -209,3 +212,116 @@ class ToolUse:
         args = " ".join(self.args)
         args_str = "" if not args else f" args='{args}'"
         return f"<tool-use>\n<{self.tool}{args_str}>\n{self.content}\n</{self.tool}>\n</tool-use>"
+
+
+class ToolUseDetector:
+    """
+    Detects runnable tool uses in streamed output, one chunk at a time.
+
+    Keeps the state of the codeblock fences and ``<tool-use>`` elements seen so far,
+    so each chunk is only scanned once, instead of parsing the whole output again
+    with `ToolUse.iter_from_content` after every chunk.
+    """
+
+    def __init__(self):
+        # length of the output so far
+        self.pos = 0
+        # start and content of the current line, None if it isn't a fence
+        self._line_start = 0
+        self._line: str | None = ""
+        # langs of the open codeblocks, and whether the outermost one is runnable
+        self._stack: list[str] = []
+        self._runnable = False
+        # start and content of the current <tool-use> element, if inside one
+        self._xml_start = 0
+        self._xml: str | None = None
+        # end of the output, in case a tag is split across chunks
+        self._tail = ""
+
+    def feed(self, chunk: str) -> int | None:
+        """
+        Consumes a chunk of output.
+
+        Returns the length of the output up to the end of the first runnable tool use closed in it,
+        where inference should pause to run it, or None.
+        """
+        pos = self.pos
+        self.pos += len(chunk)
+        ends = []
+        if mode == "markdown" or not exclusive_mode:
+            ends.append(self._feed_markdown(chunk, pos))
+        if mode == "xml" or not exclusive_mode:
+            ends.append(self._feed_xml(chunk, pos))
+        return min((end for end in ends if end is not None), default=None)
+
+    def _feed_markdown(self, chunk: str, pos: int) -> int | None:
+        end = None
+        pieces = chunk.split("\n")
+        for n, piece in enumerate(pieces):
+            line = None
+            if self._line is not None:
+                line = self._line + piece
+                stripped = line.lstrip()
+                if stripped.startswith("```"):
+                    # a fence closes the outermost codeblock as soon as its backticks are in,
+                    # like parsing the output so far would
+                    fence_end = len(line) - len(stripped) + 3
+                    if (
+                        end is None
+                        and fence_end > len(self._line)
+                        and len(self._stack) == 1
+                        and self._runnable
+                    ):
+                        end = self._line_start + fence_end
+                elif stripped and not "```".startswith(stripped[:3]):
+                    line = None
+            pos += len(piece)
+            if n == len(pieces) - 1:
+                self._line = line
+                break
+            if line is not None:
+                self._end_line(line)
+            pos += 1
+            self._line_start, self._line = pos, ""
+        return end
+
+    def _end_line(self, line: str) -> None:
+        """Updates the open codeblocks with a fence line, like `Codeblock.iter_from_markdown`."""
+        stripped = line.strip()
+        if not stripped.startswith("```"):
+            return
+        lang = stripped[3:]
+        if not self._stack:
+            self._stack.append(lang)
+            tool_use = ToolUse._from_codeblock(Codeblock(lang, ""))
+            self._runnable = bool(tool_use and tool_use.is_runnable)
+        elif lang and self._stack[-1] != lang:
+            self._stack.append(lang)
+        else:
+            self._stack.pop()
+
+    def _feed_xml(self, chunk: str, pos: int) -> int | None:
+        if self._xml is None:
+            buf = self._tail + chunk
+            i = buf.find("<tool-use>")
+            if i == -1:
+                self._tail = buf[-len("<tool-use") :]
+                return None
+            self._xml_start = pos - len(self._tail) + i
+            self._xml, self._tail = buf[i:], ""
+            scan_from = len("<tool-use>")
+        else:
+            # the closing tag may have started in the previous chunk
+            scan_from = max(len(self._xml) - len("</tool-use"), 0)
+            self._xml += chunk
+        i = self._xml.find("</tool-use>", scan_from)
+        if i == -1:
+            return None
+        i += len("</tool-use>")
+        element, rest = self._xml[:i], self._xml[i:]
+        end = self._xml_start + i
+        self._xml = None
+        runnable = any(t.is_runnable for t in ToolUse._iter_from_xml(element))
+        # the rest of the chunk is scanned either way, to keep the state consistent
+        end_rest = self._feed_xml(rest, end)
+        return end if runnable else end_rest
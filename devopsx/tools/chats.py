@@ -165,17 +165,14 @@ def read_chat(conversation: str, max_results: int = 5, incl_system=False) -> Non
         incl_system (bool): Whether to include system messages.
     """
     # noreorder
-    from ..logmanager import LogManager, get_conversations  # fmt: skip
+    from ..logmanager import _gen_read_log, get_conversations  # fmt: skip
 
-    conversations = list(get_conversations())
-
-    for conv in conversations:
+    for conv in get_conversations():
         if conv.name == conversation:
-            log_path = Path(conv.path)
-            logmanager = LogManager.load(log_path)
             print(f"Reading conversation: {conversation}")
             i = 0
-            for msg in logmanager.log:
+            # only read as much of the log as we display
+            for msg in _gen_read_log(conv.path):
                 if msg.role != "system" or incl_system:
                     print(f"{i}. {_format_message_snippet(msg)}")
                     i += 1
@@ -15,7 +15,8 @@ import subprocess
 from collections.abc import Generator
 
 from ..message import Message, print_msg
-from ..util import ask_execute, get_tokenizer, print_preview
+from ..tokens import get_tokenizer
+from ..util import ask_execute, print_preview
 from .base import ToolSpec, ToolUse
 
 logger = logging.getLogger(__name__)
@@ -343,14 +344,8 @@ def _shorten_stdout(
     # check that if pre_tokens is set, so is post_tokens, and vice versa
     assert (pre_tokens is None) == (post_tokens is None)
     if pre_tokens is not None and post_tokens is not None:
-        tokenizer = get_tokenizer("gpt-4")  # TODO: use sane default
-        tokens = tokenizer.encode(stdout)
-        if len(tokens) > pre_tokens + post_tokens:
-            lines = (
-                [tokenizer.decode(tokens[:pre_tokens])]
-                + ["... (truncated output) ..."]
-                + [tokenizer.decode(tokens[-post_tokens:])]
-            )
+        if split := get_tokenizer().split(stdout, pre_tokens, post_tokens):
+            lines = [split[0], "... (truncated output) ...", split[1]]
 
     return "\n".join(lines)
 
@@ -7,6 +7,7 @@ Lets devopsx break down a task into smaller parts, and delegate them to subthrea
 import json
 import logging
 import threading
+from pathlib import Path
 from dataclasses import asdict, dataclass
 from typing import TYPE_CHECKING, Literal
 
@@ -36,20 +37,29 @@ class Subthread:
     agent_id: str
     thread: threading.Thread
 
-    def get_log(self) -> "LogManager":
+    def get_logdir(self) -> Path:
         # noreorder
         from devopsx.cli import get_logdir  # fmt: skip
 
+        return get_logdir(f"subthread-{self.agent_id}")
+
+    def get_log(self) -> "LogManager":
+        # noreorder
         from ..logmanager import LogManager  # fmt: skip
 
-        name = f"subthread-{self.agent_id}"
-        return LogManager.load(get_logdir(name))
+        return LogManager.load(self.get_logdir())
 
     def status(self) -> ReturnType:
         if self.thread.is_alive():
             return ReturnType("running")
+        # noreorder
+        from ..logmanager import _find_logfile, _read_log_tail  # fmt: skip
+
         # check if the last message contains the return JSON
-        msg = self.get_log().log[-1].content.strip()
+        # only reads the end of the log, which can get long
+        logfile = _find_logfile(self.get_logdir())
+        assert logfile, "subthread has no log"
+        msg = _read_log_tail(logfile, 1)[0].content.strip()
         json_response = _extract_json(msg)
         if not json_response:
             print(f"FAILED to find JSON in message: {msg}")
@@ -0,0 +1,175 @@
+"""
+The HTTP connection pool shared by the LLM provider clients.
+
+Configured in the ``[http]`` section of ``config.toml``, for example:
+
+.. code-block:: toml
+
+    [http]
+    max_connections = 100
+    max_keepalive_connections = 20
+    keepalive_expiry = 30.0
+    http2 = true
+    connect_timeout = 10.0
+    read_timeout = 600.0
+    compress_requests = false
+
+HTTP/2 is used if the ``h2`` package is installed (``httpx[http2]``).
+
+Proxies are configured with the usual ``HTTP_PROXY``, ``HTTPS_PROXY``, ``ALL_PROXY``
+and ``NO_PROXY`` environment variables, with a shared pool for each proxy.
+"""
+
+import gzip
+import asyncio
+import logging
+import threading
+import weakref
+from dataclasses import dataclass, fields
+
+import httpx
+from httpx._utils import get_environment_proxies
+
+from .config import get_config
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # pragma: no cover
+    h2 = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# request bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+@dataclass(frozen=True)
+class HTTPConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    # seconds an idle connection is kept open
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    connect_timeout: float = 10.0
+    # max seconds between received bytes, not for the whole response
+    read_timeout: float = 600.0
+    # gzip request bodies, only for endpoints that accept it
+    compress_requests: bool = False
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "HTTPConfig":
+        names = {f.name for f in fields(cls)}
+        if unknown := set(d) - names:
+            logger.warning(f"Unknown keys in [http] config: {unknown}")
+        return cls(**{k: v for k, v in d.items() if k in names})
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            self.read_timeout, connect=self.connect_timeout, pool=self.connect_timeout
+        )
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    """
+    An async transport with a keep-alive connection pool, shared by several clients.
+
+    Connections belong to the event loop that opened them, so there is a pool per loop.
+    """
+
+    def __init__(self, config: HTTPConfig, proxy: str | None = None):
+        self.config = config
+        self.proxy = proxy
+        self.http2 = config.http2 and h2 is not None
+        if config.http2 and not self.http2:
+            logger.debug("HTTP/2 requires the h2 package, using HTTP/1.1")
+        self._pools: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport
+        ] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._pools:
+                self._pools[loop] = httpx.AsyncHTTPTransport(
+                    limits=self.config.limits, http2=self.http2, proxy=self.proxy
+                )
+            return self._pools[loop]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.config.compress_requests:
+            request = await _compress(request)
+        return await self._get_pool().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        # clients close their transport when closed, but the pool outlives them
+        pass
+
+
+async def _compress(request: httpx.Request) -> httpx.Request:
+    if "content-encoding" in request.headers:
+        return request
+    body = await request.aread()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return request
+    headers = httpx.Headers(request.headers)
+    headers["content-encoding"] = "gzip"
+    del headers["content-length"]
+    return httpx.Request(
+        request.method,
+        request.url,
+        headers=headers,
+        content=gzip.compress(body),
+        extensions=request.extensions,
+    )
+
+
+_transport: SharedTransport | None = None
+_proxy_transports: dict[str, SharedTransport] = {}
+
+
+def get_http_config() -> HTTPConfig:
+    return HTTPConfig.from_dict(get_config().http)
+
+
+def get_transport() -> SharedTransport:
+    """Returns the transport shared by all provider clients, created on first use."""
+    global _transport
+    if _transport is None:
+        _transport = SharedTransport(get_http_config())
+    return _transport
+
+
+def get_proxy_mounts() -> dict[str, httpx.AsyncBaseTransport | None]:
+    """
+    Returns transports for the proxies set in the environment, to mount on a client.
+
+    httpx ignores the proxy environment variables for clients given a transport,
+    hosts in ``NO_PROXY`` are mounted as None, so they use the client's transport.
+    """
+    mounts: dict[str, httpx.AsyncBaseTransport | None] = {}
+    for pattern, proxy in get_environment_proxies().items():
+        if proxy is None:
+            mounts[pattern] = None
+            continue
+        if proxy not in _proxy_transports:
+            _proxy_transports[proxy] = SharedTransport(get_transport().config, proxy=proxy)
+        mounts[pattern] = _proxy_transports[proxy]
+    return mounts
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns a new client on the shared transport, for a provider SDK."""
+    transport = get_transport()
+    return httpx.AsyncClient(
+        transport=transport, mounts=get_proxy_mounts(), timeout=transport.config.timeout
+    )
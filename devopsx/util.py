@@ -10,7 +10,6 @@ from pathlib import Path
 from functools import lru_cache
 from datetime import datetime, timedelta
 
-import tiktoken
 from rich import print
 from rich.console import Console
 from rich.syntax import Syntax
@@ -22,18 +21,6 @@ logger = logging.getLogger(__name__)
 console = Console(log_path=False)
 
 
-def get_tokenizer(model: str):
-    if "gpt-4" in model or "gpt-3.5" in model:
-        return tiktoken.encoding_for_model(model)
-    else:  # pragma: no cover
-        logger.warning(
-            f"No encoder implemented for model {model}."
-            "Defaulting to tiktoken cl100k_base encoder."
-            "Use results only as estimates."
-        )
-        return tiktoken.get_encoding("cl100k_base")
-
-
 actions = [
     "running",
     "jumping",
@@ -1,7 +1,7 @@
 import logging
 from datetime import datetime
 
-from devopsx.logmanager import Conversation, _read_jsonl, get_user_conversations
+from devopsx.logmanager import Conversation, _read_log, get_user_conversations
 
 # Set up logging
 logging.basicConfig(level=logging.ERROR)
@@ -14,7 +14,7 @@ def print_user_messages(conv: Conversation):
     :param conversation: A dictionary containing conversation details
     """
     lines = []
-    msgs = _read_jsonl(conv.path)
+    msgs = _read_log(conv.path)
     for message in msgs:
         if message.role == "user":
             first_line = message.content.split("\n")[0]
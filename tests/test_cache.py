@@ -0,0 +1,88 @@
+import itertools
+
+import pytest
+from devopsx import llm
+from devopsx.cache import ResponseCache, request_key
+from devopsx.message import Message
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(tmp_path / "responses.sqlite")
+
+
+def _key(content: str) -> str:
+    return request_key("openai", "gpt-4", {}, [Message("user", content)], stream=True)
+
+
+def test_request_key():
+    msgs = [Message("user", "hello")]
+    key = request_key("openai", "gpt-4", {"temperature": 0}, msgs, stream=False)
+    # timestamps don't matter
+    assert key == request_key("openai", "gpt-4", {"temperature": 0}, [Message("user", "hello")], stream=False)
+    assert key != request_key("openai", "gpt-4o", {"temperature": 0}, msgs, stream=False)
+    assert key != request_key("openai", "gpt-4", {"temperature": 1}, msgs, stream=False)
+    assert key != request_key("openai", "gpt-4", {"temperature": 0}, msgs, stream=True)
+
+
+def test_cache_stream(cache):
+    calls = []
+
+    def request():
+        calls.append(True)
+        yield from ["Hello", ", ", "world"]
+
+    assert list(cache.stream(_key("a"), request)) == ["Hello", ", ", "world"]
+    # replayed chunk by chunk
+    assert list(cache.stream(_key("a"), request)) == ["Hello", ", ", "world"]
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_stream_incomplete(cache):
+    def request():
+        yield from ["one ", "two ", "three"]
+
+    # stopped early, like when pausing on a tool use
+    assert list(itertools.islice(cache.stream(_key("a"), request), 2)) == ["one ", "two "]
+    assert cache.get(_key("a")) == (["one ", "two "], False)
+
+    # replays the cached chunks, then continues with a request
+    assert "".join(cache.stream(_key("a"), request)) == "one two three"
+    assert cache.get(_key("a")) == (["one ", "two ", "three"], True)
+
+
+def test_cache_ttl(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite", ttl=-1)
+    cache.put(_key("a"), ["hi"])
+    assert cache.get(_key("a")) is None
+
+
+def test_cache_lru(tmp_path):
+    cache = ResponseCache(tmp_path / "responses.sqlite", max_bytes=100)
+    cache.put(_key("a"), ["a" * 40])
+    cache.put(_key("b"), ["b" * 40])
+    # a is used more recently than b, so b is evicted
+    cache.get(_key("a"))
+    cache.put(_key("c"), ["c" * 40])
+    assert cache.get(_key("a")) is not None
+    assert cache.get(_key("b")) is None
+    assert cache.get(_key("c")) is not None
+
+
+def test_chat_complete_cached(monkeypatch, tmp_path):
+    monkeypatch.setenv("LLM_CACHE", "true")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr("devopsx.cache._cache", None)
+    monkeypatch.setattr(llm, "_client_to_provider", lambda: "openai")
+    calls = []
+
+    async def achat_fake(messages, model):
+        calls.append(messages)
+        return "Hi there"
+
+    monkeypatch.setattr(llm, "achat_openai", achat_fake)
+    msgs = [Message("user", "hello")]
+    assert llm._chat_complete(msgs, "gpt-4") == "Hi there"
+    assert llm._chat_complete(msgs, "gpt-4") == "Hi there"
+    assert len(calls) == 1
@@ -0,0 +1,49 @@
+from devopsx import catalog
+from devopsx.dirs import get_logs_dir
+from devopsx.logmanager import LogManager, Message, get_conversations
+
+
+def test_catalog(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    logsdir = get_logs_dir()
+
+    # written conversations are added to the catalog
+    log = LogManager([Message("user", "hello")], logdir=logsdir / "test-catalog-1")
+    log.write()
+    log.append(Message("assistant", "hi"))
+    convs = list(get_conversations())
+    assert [c.name for c in convs] == ["test-catalog-1"]
+    assert convs[0].messages == 2
+    assert convs[0].branches == 1
+
+    # conversations written by other means are picked up, most recent first
+    log2 = LogManager([Message("user", "hello")], logdir=logsdir / "test-catalog-2")
+    log2.write()
+    catalog.remove("test-catalog-2")
+    assert [c.name for c in get_conversations()] == ["test-catalog-2", "test-catalog-1"]
+
+    # renamed conversations replace their old entry
+    log.rename("test-catalog-3")
+    assert {c.name for c in get_conversations()} == {"test-catalog-2", "test-catalog-3"}
+
+    # reindex rebuilds from disk
+    assert catalog.reindex() == 2
+    convs = {c.name: c for c in get_conversations()}
+    assert convs["test-catalog-3"].messages == 2
+
+
+def test_catalog_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "a"))
+    log = LogManager([Message("user", "hello")], logdir=get_logs_dir() / "test-conn")
+    log.write()
+    conn = catalog._conn
+    # appends reuse the connection of the process
+    for i in range(3):
+        log.append(Message("user", f"message {i}", quiet=True))
+    assert catalog._conn is conn
+    assert next(catalog.get_entries()).messages == 4
+
+    # reopened for another logs dir
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "b"))
+    assert list(catalog.get_entries()) == []
+    assert catalog._conn is not conn
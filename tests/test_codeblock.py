@@ -1,3 +1,6 @@
+import time
+
+import pytest
 from devopsx.codeblock import Codeblock
 
 
@@ -78,4 +81,28 @@ def hello():
 """
     assert Codeblock.iter_from_markdown(markdown) == [
         Codeblock("", 'def hello():\n    print("Hello, World!")')
-    ]
\ No newline at end of file
+    ]
+
+
+def test_extract_codeblocks_start():
+    markdown = """Text
+  ```python
+print("a")
+```
+```sh
+ls
+```"""
+    codeblocks = Codeblock.iter_from_markdown(markdown)
+    assert [c.start for c in codeblocks] == [7, markdown.index("```sh")]
+    for codeblock in codeblocks:
+        assert markdown[codeblock.start :].startswith(f"```{codeblock.lang}")
+
+
+@pytest.mark.slow
+def test_extract_codeblocks_bench():
+    block = "Some text\n" * 20 + "```python\n" + "print('hello')\n" * 200 + "```\n"
+    markdown = block * (1_000_000 // len(block))
+    t0 = time.perf_counter()
+    codeblocks = Codeblock.iter_from_markdown(markdown)
+    print(f"extracted {len(codeblocks)} codeblocks from {len(markdown)} chars: {time.perf_counter() - t0:.3f}s")
+    assert len(codeblocks) == 1_000_000 // len(block)
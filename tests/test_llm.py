@@ -0,0 +1,99 @@
+import io
+import time
+import asyncio
+
+import pytest
+from devopsx import llm
+from devopsx.llm import _iter_sync, _OutputBuffer, _reply_stream, _run_sync
+from devopsx.message import Message
+from devopsx.tools import init_tools
+
+
+class _CountingIO(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+def test_output_buffer():
+    file = _CountingIO()
+    out = _OutputBuffer(file, size=10, interval=60)
+    for c in "hello world!":
+        out.write(c)
+    # flushed once the size was reached
+    assert file.getvalue() == "hello worl"
+    out.flush()
+    assert file.getvalue() == "hello world!"
+    assert file.writes == 2
+
+
+def test_run_sync():
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    assert _run_sync(add(1, 2)) == 3
+
+
+def test_iter_sync_closes():
+    closed = []
+
+    async def gen():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(True)
+
+    items = _iter_sync(gen())
+    assert [next(items) for _ in range(3)] == [0, 1, 2]
+    # stopping early closes the async generator, like a request stopped on a tool use
+    items.close()
+    assert closed == [True]
+
+
+def test_astream_concurrent(monkeypatch):
+    async def astream_fake(messages, model):
+        for word in ["hello", " ", "world"]:
+            await asyncio.sleep(0.01)
+            yield word
+
+    monkeypatch.setattr(llm, "_client_to_provider", lambda: "openai")
+    monkeypatch.setattr(llm, "astream_openai", astream_fake)
+
+    async def generate():
+        return "".join([c async for c in llm.astream([Message("user", "hi")], "gpt-4")])
+
+    async def main():
+        return await asyncio.gather(*(generate() for _ in range(200)))
+
+    t0 = time.perf_counter()
+    assert asyncio.run(main()) == ["hello world"] * 200
+    # multiplexed on one thread, instead of taking 200 * 0.03s
+    assert time.perf_counter() - t0 < 1
+
+
+def test_reply_stream(monkeypatch):
+    init_tools()
+    chunks = ["Let's ", "check:\n``", "`shell\nls\n`", "``\nand ", "the rest"]
+    monkeypatch.setattr("devopsx.llm._stream", lambda messages, model: iter(chunks))
+    msg = _reply_stream([Message("user", "hi")], "gpt-4")
+    # paused at the end of the runnable codeblock
+    assert msg.content == "Let's check:\n```shell\nls\n```"
+
+
+@pytest.mark.slow
+def test_reply_stream_bench(monkeypatch, capsys):
+    # a fast provider, emitting many small chunks
+    chunks = ["word "] * 100_000
+    monkeypatch.setattr("devopsx.llm._stream", lambda messages, model: iter(chunks))
+    t0 = time.perf_counter()
+    msg = _reply_stream([Message("user", "hi")], "gpt-4")
+    elapsed = time.perf_counter() - t0
+    with capsys.disabled():
+        print(f"streamed {len(chunks)} chunks: {elapsed:.3f}s")
+    assert len(msg.content) == 5 * len(chunks)
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+from devopsx import logformat
+from devopsx.logmanager import LogManager, Message, _read_log, _write_log
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "msgpack"])
+def test_roundtrip(tmp_path, fmt):
+    if fmt == "msgpack":
+        pytest.importorskip("msgpack")
+    path = tmp_path / f"conversation{logformat.get_format(fmt).ext}"
+    msgs = [
+        Message("user", "hello\nworld", files=[tmp_path / "a.txt"], pinned=True),
+        Message("assistant", "non-ascii: åäö ☃", hide=True),
+    ]
+    _write_log(path, msgs)
+    assert _read_log(path) == msgs
+
+
+def test_roundtrip_surrogates(tmp_path):
+    # like shell output decoded with surrogateescape, which orjson rejects
+    logdir = tmp_path / "test-surrogates"
+    log = LogManager([Message("user", "hello")], logdir=logdir)
+    log.append(Message("system", "bad \udcff byte"))
+    assert LogManager.load(logdir).log == log.log
+
+
+def test_torn_append_msgpack(tmp_path):
+    pytest.importorskip("msgpack")
+    path = tmp_path / "conversation.msgpack"
+    msgs = [Message("user", f"msg {i}") for i in range(3)]
+    _write_log(path, msgs)
+    with open(path, "ab") as f:
+        f.write(logformat.get_format("msgpack").dumps(msgs[0])[:5])
+    assert _read_log(path) == msgs
+
+
+def test_migrate(tmp_path):
+    pytest.importorskip("msgpack")
+    logdir = tmp_path / "test-migrate"
+    log = LogManager([Message("user", "hello")], logdir=logdir)
+    log.append(Message("assistant", "hi"))
+    log.undo(1, quiet=True)
+    log.migrate("msgpack")
+    assert not list(logdir.rglob("*.jsonl"))
+    assert (logdir / "conversation.msgpack").exists()
+
+    # the format is detected when loaded, and new messages are appended in it
+    log2 = LogManager(logdir=logdir)
+    assert log2.format.name == "msgpack"
+    assert log2.log == log.log
+    log2.append(Message("assistant", "hi again"))
+    assert len(LogManager(logdir=logdir).log) == 2
+    assert "main-undo-0" in log2._branches
+
+
+def _bench(path, msgs, n=5) -> tuple[float, float]:
+    write = read = float("inf")
+    for _ in range(n):
+        t0 = time.perf_counter()
+        _write_log(path, msgs)
+        t1 = time.perf_counter()
+        assert len(_read_log(path)) == len(msgs)
+        t2 = time.perf_counter()
+        write, read = min(write, t1 - t0), min(read, t2 - t1)
+    return write, read
+
+
+@pytest.mark.slow
+def test_format_bench(tmp_path, monkeypatch):
+    pytest.importorskip("msgpack")
+    msgs = [
+        Message("user" if i % 2 else "assistant", f"message {i}\n" + "x" * 500)
+        for i in range(20_000)
+    ]
+    results = {}
+    for fmt in ["jsonl", "msgpack"]:
+        path = tmp_path / f"conversation{logformat.get_format(fmt).ext}"
+        results[fmt] = _bench(path, msgs)
+        results[fmt] += (path.stat().st_size,)
+    if logformat.orjson is not None:
+        monkeypatch.setattr(logformat, "orjson", None)
+        results["jsonl (stdlib)"] = _bench(tmp_path / "stdlib.jsonl", msgs)
+    for name, (write, read, *size) in results.items():
+        print(f"{name}: write {write*1000:.0f}ms, read {read*1000:.0f}ms", *size)
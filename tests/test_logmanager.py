@@ -1,4 +1,19 @@
-from devopsx.logmanager import LogManager, Message
+import json
+import time
+
+import pytest
+from devopsx.logmanager import (
+    LogManager,
+    Message,
+    _count_jsonl,
+    _gen_read_jsonl_reverse,
+    _read_log,
+    _read_log_tail,
+    _write_log,
+)
+from devopsx.models import get_model
+from devopsx.reduce import ContextWindow
+
 
 def test_branch():
     log = LogManager()
@@ -28,3 +43,194 @@ def test_branch():
     d = log.to_dict(branches=True)
     assert "main" in d["branches"]
     assert "dev" in d["branches"]
+
+
+def test_append_journal(tmp_path):
+    log = LogManager(logdir=tmp_path / "test-journal", branch="dev")
+    log.append(Message("user", "hello"))
+    log.append(Message("assistant", "world"))
+    logfile = log.logfile
+    assert len(logfile.read_text().splitlines()) == 2
+
+    # a torn write from an interrupted append is skipped on read
+    with open(logfile, "a") as f:
+        f.write('{"role": "user", "cont')
+    log2 = LogManager(logdir=tmp_path / "test-journal", branch="dev")
+    assert [m.content for m in log2.log] == ["hello", "world"]
+
+    # appending after the torn line still works, and compaction drops it
+    log.append(Message("user", "again"))
+    log.compact()
+    lines = logfile.read_text().splitlines()
+    assert len(lines) == 3
+    assert '"again"' in lines[-1]
+
+    # undo rewrites the journal
+    log.undo(1, quiet=True)
+    assert len(logfile.read_text().splitlines()) == 2
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "msgpack"])
+def test_append_after_torn(tmp_path, monkeypatch, fmt):
+    if fmt == "msgpack":
+        pytest.importorskip("msgpack")
+    monkeypatch.setenv("LOG_FORMAT", fmt)
+    logdir = tmp_path / "test-torn"
+    log = LogManager(logdir=logdir)
+    log.append(Message("user", "hello"))
+    with open(log.logfile, "ab") as f:
+        f.write(log.format.dumps(Message("user", "torn"))[:10])
+
+    # appending after a torn tail (in a new session) doesn't append to the torn record
+    log2 = LogManager.load(logdir)
+    log2.append(Message("assistant", "world"))
+    assert [m.content for m in LogManager.load(logdir).log] == ["hello", "world"]
+
+
+def _time_writes(log: LogManager, n: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        log.write()
+    return time.perf_counter() - start
+
+
+@pytest.mark.slow
+def test_write_cost_flat_with_backup_branches(tmp_path):
+    msgs = [
+        Message("user" if i % 2 else "assistant", f"message {i} " * 20)
+        for i in range(500)
+    ]
+    log = LogManager(msgs, logdir=tmp_path / "test-bench-branches")
+    log.write()
+
+    log._save_backup_branch(type="undo")
+    t_few = _time_writes(log)
+
+    for _ in range(50):
+        log._save_backup_branch(type="undo")
+    t_many = _time_writes(log)
+
+    print(f"write() with 1 backup: {t_few:.4f}s, with 51 backups: {t_many:.4f}s")
+    assert len(list((tmp_path / "test-bench-branches" / "branches").glob("*.jsonl"))) == 51
+    # frozen backup branches are skipped, so cost should not scale with their count
+    assert t_many < 3 * t_few + 0.01
+
+
+def test_backup_branches_share_history(tmp_path):
+    logdir = tmp_path / "test-cow"
+    msgs = [Message("user", f"msg {i}") for i in range(10)]
+    log = LogManager(list(msgs), logdir=logdir)
+    log.write()
+
+    # the backup only stores the undone messages
+    log.undo(2, quiet=True)
+    assert len((logdir / "branches" / "main-undo-0.jsonl").read_text().splitlines()) == 2
+
+    # editing earlier messages moves the shared messages into the backups
+    log.edit(log.log[:5] + [Message("user", "edited")])
+    assert len((logdir / "branches" / "main-edit-0.jsonl").read_text().splitlines()) == 3
+    assert len((logdir / "branches" / "main-undo-0.jsonl").read_text().splitlines()) == 5
+
+    # reloading restores the full branches
+    log2 = LogManager(logdir=logdir)
+    assert [m.content for m in log2.log] == [f"msg {i}" for i in range(5)] + ["edited"]
+    assert log2.diff("main-edit-0") == "\n".join(
+        ["+ User: edited"] + [f"- User: msg {i}" for i in range(5, 8)]
+    )
+    log2.branch("main-undo-0")
+    assert log2.log == msgs
+
+
+def test_lazy_branches(tmp_path):
+    logdir = tmp_path / "test-lazy"
+    log = LogManager([Message("user", f"msg {i}") for i in range(3)], logdir=logdir)
+    log.write()
+    log.branch("dev")
+    log.append(Message("assistant", "on dev"))
+    log.branch("main")
+    log.undo(1, quiet=True)
+
+    # only the current branch is read on load
+    log2 = LogManager(logdir=logdir)
+    assert log2._unloaded == {"dev", "main-undo-0"}
+    assert len(log2) == 2
+
+    # other branches are read on first access
+    assert log2.diff("dev") == "- User: msg 2\n- Assistant: on dev"
+    assert log2._unloaded == {"main-undo-0"}
+    d = log2.to_dict(branches=True)
+    assert len(d["branches"]["main-undo-0"]) == 3
+    assert not log2._unloaded
+
+
+def test_log_replaces_branch_with_children(tmp_path):
+    logdir = tmp_path / "test-replace"
+    msgs = [Message("user", f"msg {i}") for i in range(4)]
+    log = LogManager(list(msgs), logdir=logdir)
+    log.write()
+    log.undo(1, quiet=True)
+
+    # a given log replaces main, its children keep the messages they forked from
+    log2 = LogManager([Message("user", "new")], logdir=logdir)
+    log2.write()
+    assert json.loads((logdir / "branches" / "index.json").read_text()) == {}
+    log3 = LogManager(logdir=logdir)
+    assert [m.content for m in log3.log] == ["new"]
+    log3.branch("main-undo-0")
+    assert log3.log == msgs
+    assert not list(logdir.glob("**/*.tmp"))
+
+
+def test_read_jsonl_partial(tmp_path):
+    path = tmp_path / "conversation.jsonl"
+    msgs = [Message("user", f"msg {i}\nwith a newline") for i in range(100)]
+    _write_log(path, msgs)
+
+    assert _read_log(path, limit=2) == msgs[:2]
+    assert _read_log_tail(path, 3) == msgs[-3:]
+    assert _read_log_tail(path, 1000) == msgs
+    # small blocks, so lines span block boundaries
+    assert list(_gen_read_jsonl_reverse(path, block_size=7)) == msgs[::-1]
+    assert _count_jsonl(path, block_size=7) == 100
+
+
+def test_count_jsonl_torn(tmp_path):
+    path = tmp_path / "conversation.jsonl"
+    msgs = [Message("user", f"msg {i}") for i in range(3)]
+    _write_log(path, msgs)
+    data = path.read_bytes()
+
+    # blank lines aren't messages
+    path.write_bytes(data + b"\n  \n")
+    assert _count_jsonl(path, block_size=7) == 3
+    # a truncated last record isn't counted, like it isn't read
+    path.write_bytes(data + b"\n" + data.splitlines()[0][:20])
+    assert _count_jsonl(path, block_size=7) == 3 == len(_read_log(path))
+    # a complete last record without a newline is
+    path.write_bytes(data.rstrip(b"\n"))
+    assert _count_jsonl(path) == 3
+
+
+@pytest.mark.parametrize("summarize", ["true", "false"])
+def test_prepare_messages_summarize(monkeypatch, summarize):
+    monkeypatch.setenv("REDUCE_SUMMARIZE", summarize)
+    monkeypatch.setattr("devopsx.models.DEFAULT_MODEL", get_model("openai/gpt-4o"))
+    log = LogManager([Message("system", "system prompt"), Message("user", "hello")])
+    assert log.prepare_messages() == log.log
+    assert log._window is not None
+    assert log._window.summarize == (summarize == "true")
+
+
+def test_prepared_window_updates():
+    log = LogManager([Message("system", "system prompt")])
+    log._window = ContextWindow(1000)
+    log._window.extend(log.log)
+    for i in range(5):
+        log.append(Message("user", f"message {i}"))
+    log.undo(2, quiet=True)
+    log.edit([*log.log[:2], Message("user", "edited")])
+    log.append(Message("assistant", "hi"))
+
+    fresh = ContextWindow(1000)
+    fresh.extend(log.log)
+    assert log._window.messages == fresh.messages == log.log
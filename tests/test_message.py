@@ -1,4 +1,19 @@
-from devopsx.message import Message, msgs_to_toml, toml_to_msgs
+import copy
+import time
+import tracemalloc
+from dataclasses import FrozenInstanceError
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from devopsx import message
+from devopsx.logmanager import _read_log, _write_log
+from devopsx.message import (
+    Message,
+    msgs2dicts,
+    msgs_to_toml,
+    toml_to_msgs,
+)
 
 
 def test_toml():
@@ -61,3 +76,79 @@ That's all folks!
     )
     codeblocks = msg.get_codeblocks()
     assert len(codeblocks) == 2
+
+
+def test_msgs2dicts(monkeypatch):
+    msgs = [Message("user", "hello"), Message("assistant", "hi")]
+
+    # storage format and explicit models don't look up the current model
+    monkeypatch.setattr(message, "get_model", lambda: pytest.fail("get_model called"))
+    assert msgs[0].to_dict()["role"] == "user"
+    assert msgs2dicts(msgs, openai=True, model="gpt-4o") == [
+        {"role": "user", "content": [{"type": "text", "text": "hello"}]},
+        {"role": "assistant", "content": [{"type": "text", "text": "hi"}]},
+    ]
+
+    # system messages are sent as user messages where unsupported
+    sys_msg = Message("system", "be nice")
+    assert msgs2dicts([sys_msg], openai=True, model="o1-mini")[0]["role"] == "user"
+    assert msgs2dicts([sys_msg], ollama=True)[0]["role"] == "user"
+    assert msgs2dicts([sys_msg])[0]["role"] == "system"
+
+    # o1 models are sent every message as a user message, ollama only the system ones
+    dicts = msgs2dicts([sys_msg, *msgs], openai=True, model="o1-mini")
+    assert [d["role"] for d in dicts] == ["user", "user", "user"]
+    dicts = msgs2dicts([sys_msg, *msgs], ollama=True)
+    assert [d["role"] for d in dicts] == ["user", "user", "assistant"]
+
+
+@pytest.mark.slow
+def test_msgs2dicts_bench(tmp_path):
+    msgs = [Message("user", f"message {i}\n" + "x" * 200) for i in range(5000)]
+
+    def best_of(f, n=20) -> float:
+        best = float("inf")
+        for _ in range(n):
+            t0 = time.perf_counter()
+            f()
+            best = min(best, time.perf_counter() - t0)
+        return best
+
+    t_dicts = best_of(lambda: msgs2dicts(msgs, openai=True, model="gpt-4o"))
+    t_write = best_of(lambda: _write_log(tmp_path / "conversation.jsonl", msgs))
+    print(f"msgs2dicts: {t_dicts*1000:.1f}ms, _write_log: {t_write*1000:.1f}ms")
+
+
+def test_message_compact():
+    ts = datetime(2024, 1, 2, 3, 4, 5, 678901)
+    msg = Message("user", "hello", timestamp=ts)
+    assert msg.timestamp == ts
+    assert msg.files == ()
+    assert not hasattr(msg, "__dict__")
+    with pytest.raises(FrozenInstanceError):
+        msg.content = "bye"  # type: ignore
+
+    # aware timestamps keep their timezone
+    ts_utc = datetime(2024, 1, 2, tzinfo=timezone.utc)  # noqa: UP017, datetime.UTC is 3.11+
+    assert Message("user", "hi", timestamp=ts_utc).timestamp.tzinfo == timezone.utc  # noqa: UP017
+
+    msg2 = msg.replace(files=[Path("a.png")])
+    assert msg2.files == (Path("a.png"),)
+    assert msg2 == msg
+    assert copy.copy(msg2).files == msg2.files
+
+
+@pytest.mark.slow
+def test_message_memory_bench(tmp_path):
+    path = tmp_path / "conversation.jsonl"
+    roles = ["user", "assistant"]
+    _write_log(path, [Message(roles[i % 2], f"message {i}") for i in range(100_000)])
+
+    tracemalloc.start()
+    try:
+        msgs = _read_log(path)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(f"{len(msgs)} messages: {size / 1e6:.1f}MB, {size / len(msgs):.0f}B/message")
+    assert size / len(msgs) < 250
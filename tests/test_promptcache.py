@@ -0,0 +1,108 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from devopsx import llm
+from devopsx.llm_anthropic import _cache_history, _transform_system_messages
+from devopsx.message import Message, msgs2dicts
+from devopsx.promptcache import (
+    cache_breakpoints,
+    get_usage,
+    prompt_cache_key,
+    record_usage,
+)
+
+
+def _conversation(n: int) -> list[Message]:
+    msgs = [Message("system", "system prompt")]
+    for i in range(n):
+        msgs += [Message("user", f"question {i}"), Message("assistant", f"answer {i}")]
+    return msgs
+
+
+def test_cache_breakpoints():
+    msgs = _conversation(3)
+    assert cache_breakpoints(msgs) == [3, 5]
+    assert cache_breakpoints(msgs, n=1) == [5]
+    assert cache_breakpoints(msgs[:1]) == []
+
+
+def test_prompt_cache_key():
+    # the same for every turn of a conversation
+    key = prompt_cache_key(_conversation(1))
+    assert key == prompt_cache_key(_conversation(5))
+    assert key != prompt_cache_key([Message("system", "other prompt"), *_conversation(1)[1:]])
+
+
+def test_record_usage(monkeypatch):
+    monkeypatch.setattr("devopsx.promptcache._usage", {})
+    record_usage("anthropic", 1000, cache_read=800, cache_write=100)
+    record_usage("anthropic", 1000, cache_read=900)
+    usage = get_usage()["anthropic"]
+    assert (usage.requests, usage.input_tokens, usage.cache_write_tokens) == (2, 2000, 100)
+    assert usage.hit_rate == 0.85
+
+
+def test_anthropic_cache_history():
+    msgs = _conversation(3)
+    prepared = list(msgs)
+    transformed, system = _transform_system_messages(prepared)
+    # the prepared messages are left as they were, for other requests
+    assert prepared == msgs
+    assert system[0]["text"] == "system prompt"
+
+    dicts = _cache_history(transformed, msgs2dicts(transformed, anthropic=True))
+    marked = [i for i, d in enumerate(dicts) if "cache_control" in d["content"][-1]]
+    assert marked == [2, 4]
+    # marking doesn't change the messages, so the next turn's prefix is the same
+    assert msgs2dicts(transformed, anthropic=True)[2]["content"][-1].get("cache_control") is None
+
+
+class _UsageHandler(BaseHTTPRequestHandler):
+    """Streams a reply like the OpenAI API, with the usage in the last chunk if requested."""
+
+    requests: list[dict] = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        self.requests.append(body)
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.end_headers()
+        base = {"id": "1", "object": "chat.completion.chunk", "created": 0, "model": body["model"]}
+        chunk = {**base, "choices": [{"index": 0, "delta": {"content": "hi"}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if body.get("stream_options", {}).get("include_usage"):
+            usage = {
+                "prompt_tokens": 2000,
+                "completion_tokens": 1,
+                "total_tokens": 2001,
+                "prompt_tokens_details": {"cached_tokens": 1536},
+            }
+            self.wfile.write(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_openai_cache_usage(monkeypatch):
+    monkeypatch.setattr(_UsageHandler, "requests", [])
+    monkeypatch.setattr("devopsx.promptcache._usage", {})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _UsageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr("devopsx.llm_openai.openai", None)
+    monkeypatch.setattr(llm, "_provider", None)
+    try:
+        llm.init_llm("openai")
+        msgs = _conversation(2)
+        assert "".join(llm._stream(msgs, "gpt-4o")) == "hi"
+    finally:
+        server.shutdown()
+
+    (body,) = _UsageHandler.requests
+    assert body["prompt_cache_key"] == prompt_cache_key(msgs)
+    usage = get_usage()["openai"]
+    assert (usage.input_tokens, usage.cache_read_tokens) == (2000, 1536)
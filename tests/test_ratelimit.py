@@ -0,0 +1,114 @@
+import time
+import asyncio
+
+from devopsx import llm
+from devopsx.message import Message
+from devopsx.ratelimit import (
+    Limits,
+    Priority,
+    RateLimiter,
+    TokenBucket,
+    _priority,
+    background,
+)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0
+    bucket.take(60)
+    # refilled at a token per second
+    assert 0.9 < bucket.wait_time(1) <= 1
+    # larger than the capacity, waits for a full bucket instead of forever
+    assert bucket.wait_time(1000) <= 60
+
+
+def test_limiter_unlimited():
+    limiter = RateLimiter({"anthropic": Limits(rpm=1)})
+    asyncio.run(limiter.acquire("openai", "gpt-4"))
+    assert limiter.stats() == {}
+
+
+def test_limiter_model_key():
+    limiter = RateLimiter({"openai": Limits(rpm=1000), "openai/gpt-4": Limits(tpm=100)})
+    counted = []
+
+    def tokens():
+        counted.append(True)
+        return 10
+
+    asyncio.run(limiter.acquire("openai", "gpt-4", tokens))
+    asyncio.run(limiter.acquire("openai", "gpt-4o", tokens))
+    assert set(limiter.stats()) == {"openai/gpt-4", "openai"}
+    # tokens only counted for the budget with tokens
+    assert len(counted) == 1
+
+
+def test_limiter_priority():
+    # a request every 50ms
+    limiter = RateLimiter({"openai": Limits(rpm=1200)})
+    order = []
+
+    async def request(name: str, priority: Priority):
+        await limiter.acquire("openai", "gpt-4", priority=priority)
+        order.append(name)
+
+    async def main():
+        # use up the budget, so the rest queue up
+        await limiter.acquire("openai", "gpt-4")
+        limiter._queues["openai"].requests.level = 0  # type: ignore
+        await asyncio.gather(
+            request("background 1", Priority.BACKGROUND),
+            request("background 2", Priority.BACKGROUND),
+            request("interactive", Priority.INTERACTIVE),
+        )
+
+    t0 = time.perf_counter()
+    asyncio.run(main())
+    assert order == ["interactive", "background 1", "background 2"]
+    # waited for the budget to refill, three times
+    assert time.perf_counter() - t0 >= 0.14
+    stats = limiter.stats()["openai"]
+    assert stats.requests == 4
+    assert stats.max_queued == 3
+    assert stats.queued == 0
+    assert stats.wait_max >= 0.14
+
+
+def test_limiter_cancel():
+    limiter = RateLimiter({"openai": Limits(rpm=1)})
+
+    async def main():
+        await limiter.acquire("openai", "gpt-4")
+        try:
+            await asyncio.wait_for(limiter.acquire("openai", "gpt-4"), 0.05)
+        except asyncio.TimeoutError:  # noqa: UP041, not the builtin on 3.10
+            pass
+
+    asyncio.run(main())
+    stats = limiter.stats()["openai"]
+    assert stats.queued == 0
+    assert limiter._queues["openai"].waiters == []
+
+
+def test_background_priority(monkeypatch):
+    # the priority is kept when requests are run on the background loop
+    priorities = []
+    limiter = RateLimiter({"openai": Limits(rpm=1000)})
+
+    async def acquire(provider, model, tokens=0, priority=None):
+        priorities.append(_priority.get())
+
+    monkeypatch.setattr(limiter, "acquire", acquire)
+    monkeypatch.setattr("devopsx.llm.get_rate_limiter", lambda: limiter)
+    monkeypatch.setattr(llm, "_client_to_provider", lambda: "openai")
+
+    async def achat_fake(messages, model):
+        return "hi"
+
+    monkeypatch.setattr(llm, "achat_openai", achat_fake)
+    msgs = [Message("user", "hello")]
+    llm._chat_complete(msgs, "gpt-4")
+    with background():
+        llm._chat_complete(msgs, "gpt-4")
+    assert priorities == [Priority.INTERACTIVE, Priority.BACKGROUND]
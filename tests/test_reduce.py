@@ -1,8 +1,10 @@
+import random
+import time
 from pathlib import Path
 
 import pytest
 from devopsx.message import Message, len_tokens
-from devopsx.reduce import reduce_log, truncate_msg
+from devopsx.reduce import ContextWindow, limit_log, reduce_log, truncate_msg
 
 # Project root
 root = Path(__file__).parent.parent
@@ -49,3 +51,153 @@ def test_reduce_log():
 
     assert len_pre > len_post
     assert len_post < limit
+
+
+def _codeblock_msg(i: int, lines: int = 50, **kwargs) -> Message:
+    code = "\n".join(f"print({i}, {j})" for j in range(lines))
+    return Message("user", f"message {i}\n```python\n{code}\n```", **kwargs)
+
+
+def test_reduce_log_pinned():
+    msgs = [_codeblock_msg(0, lines=200, pinned=True), *map(_codeblock_msg, range(1, 4))]
+    limit = len_tokens(msgs) - 1
+    reduced = list(reduce_log(msgs, limit=limit))
+    assert len_tokens(reduced) <= limit
+    # the pinned message is left as-is, even though it is the longest
+    assert reduced[0] is msgs[0]
+    assert any("[...]" in m.content for m in reduced[1:])
+
+
+@pytest.mark.slow
+def test_reduce_log_bench():
+    msgs = [_codeblock_msg(i) for i in range(10_000)]
+    limit = len_tokens(msgs) // 2
+    t0 = time.perf_counter()
+    reduced = list(reduce_log(msgs, limit=limit))
+    print(f"reduce_log on {len(msgs)} messages: {time.perf_counter() - t0:.2f}s")
+    assert len(reduced) == len(msgs)
+    assert len_tokens(reduced) <= limit
+
+
+def test_limit_log():
+    msgs = [
+        Message("system", "system prompt"),
+        *(Message("user", f"message {i}") for i in range(10)),
+    ]
+    # the initial system messages are always kept, and don't count towards the limit
+    limit = len_tokens(msgs[-3:])
+    limited, cut = limit_log(msgs, limit=limit)
+    assert cut == len(msgs) - 3
+    assert limited == [msgs[0], *msgs[-3:]]
+
+    # one token short, the oldest of them is left out
+    limited, cut = limit_log(msgs, limit=limit - 1)
+    assert limited == [msgs[0], *msgs[-2:]]
+
+    # everything fits
+    assert limit_log(msgs, limit=len_tokens(msgs)) == (msgs, 1)
+
+
+def test_context_window():
+    rng = random.Random(0)
+    log = [Message("system", "system prompt")]
+    window = ContextWindow(100)
+    window.extend(log)
+    for _ in range(200):
+        if rng.random() < 0.3:
+            n = rng.randrange(len(log) + 1)
+            del log[n:]
+            window.truncate(n)
+        else:
+            msgs = [Message("user", "word " * rng.randrange(1, 30))]
+            log += msgs
+            window.extend(msgs)
+        # without codeblocks nothing can be reduced, so it matches limiting from scratch
+        expected, cut = limit_log(list(reduce_log(log, limit=90)), limit=100)
+        assert window.messages == expected
+        assert window.start == cut
+        assert window.tokens == len_tokens(log)
+
+
+def test_context_window_reduce():
+    msgs = [*map(_codeblock_msg, range(20))]
+    window = ContextWindow(len_tokens(msgs))
+    for msg in msgs:
+        window.extend([msg])
+    assert window.tokens == len_tokens(window.msgs) <= window.reduce_limit
+    assert window.window_tokens == len_tokens(window.msgs[window.start :])
+    assert any("[...]" in m.content for m in window.messages)
+
+
+@pytest.fixture
+def fake_summarize(monkeypatch, tmp_path):
+    """Summarizes without an LLM, and caches summaries in a temporary directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    calls = []
+
+    def summarize(msgs):
+        calls.append(msgs)
+        return Message("system", f"Summary of {len(msgs)} messages")
+
+    monkeypatch.setattr("devopsx.llm.summarize", summarize)
+    return calls
+
+
+def test_reduce_log_summarize(fake_summarize):
+    # messages without codeblocks can't be truncated
+    log = [Message("system", "system prompt")]
+    log += [Message("user", f"message {i} " + "word " * 300) for i in range(20)]
+    limit = len_tokens(log) // 2
+
+    reduced = list(reduce_log(log, limit=limit, summarize=True))
+    assert len_tokens(reduced) <= limit
+    assert reduced[0] == log[0]
+    assert reduced[1].pinned and reduced[1].content.startswith("Summary of")
+    # the latest messages are kept
+    assert reduced[-4:] == log[-4:]
+    assert len(fake_summarize) == 1
+
+    # the same span is summarized from the cache
+    assert list(reduce_log(log, limit=limit, summarize=True)) == reduced
+    assert len(fake_summarize) == 1
+
+    # without summarizing, the log is returned as-is
+    assert list(reduce_log(log, limit=limit)) == log
+
+
+def test_context_window_summarize(fake_summarize):
+    log = [Message("system", "system prompt")]
+    log += [Message("user", f"message {i} " + "word " * 300) for i in range(20)]
+    context = len_tokens(log) * 2 // 3
+    window = ContextWindow(context, summarize=True)
+    window.extend(log)
+
+    msgs = window.messages
+    assert window.tokens == len_tokens(msgs) <= window.reduce_limit
+    assert msgs[1].content.startswith("Summary of")
+    assert msgs[-4:] == log[-4:]
+    n_summarized = len(fake_summarize[0])
+
+    # removing part of the summarized span brings back the rest of it
+    window.truncate(n_summarized)
+    assert window.messages == log[:n_summarized]
+    assert window.tokens == len_tokens(log[:n_summarized])
+
+    # adding the messages back summarizes the same span, from the cache
+    window.extend(log[n_summarized:])
+    assert window.messages == msgs
+    assert len(fake_summarize) == 1
+
+
+def test_context_window_slack():
+    log = [Message("system", "system prompt")]
+    window = ContextWindow(1000, slack=0.2)
+    window.extend(log)
+    prefixes = []
+    for i in range(100):
+        window.extend([Message("user", f"message {i} " + "word " * 20)])
+        assert len_tokens(window.messages) <= 1000
+        prefixes.append(window.start)
+    # the window moves a few messages at once, not every turn once it's full
+    moves = sum(a != b for a, b in zip(prefixes, prefixes[1:], strict=False))
+    assert 0 < moves < (prefixes[-1] - 1) / 2
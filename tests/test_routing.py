@@ -0,0 +1,174 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from devopsx import llm
+from devopsx.init import _init_fallbacks
+from devopsx.message import Message
+from devopsx.routing import Route, Router, RouteStats
+
+MSGS = [Message("user", "hi")]
+
+
+def test_route_parse():
+    assert Route.parse("openrouter/meta-llama/llama-3.1-70b") == Route(
+        "openrouter", "meta-llama/llama-3.1-70b"
+    )
+    with pytest.raises(ValueError):
+        Route.parse("gpt-4")
+
+
+def test_route_stats():
+    stats = RouteStats()
+    stats.record(latency=1.0)
+    stats.record(latency=2.0)
+    assert 1.0 < stats.latency < 2.0
+    stats.record(error=True)
+    assert stats.error_rate > 0
+
+
+def _fake_provider(behaviour: dict[str, tuple[float, str | None]]):
+    """Fake chat and stream functions, with a delay and a reply (or an error) per provider."""
+    calls: list[str] = []
+
+    async def chat(messages, model, provider):
+        calls.append(provider)
+        delay, reply = behaviour[provider]
+        await asyncio.sleep(delay)
+        if reply is None:
+            raise RuntimeError(f"{provider} is down")
+        return reply
+
+    async def stream(messages, model, provider):
+        calls.append(provider)
+        delay, reply = behaviour[provider]
+        await asyncio.sleep(delay)
+        if reply is None:
+            raise RuntimeError(f"{provider} is down")
+        for word in reply.split(" "):
+            yield word + " "
+
+    return chat, stream, calls
+
+
+def test_router_order():
+    chat, stream, _ = _fake_provider({})
+    router = Router(chat, stream)
+    routes = [Route("openai", "a"), Route("anthropic", "b"), Route("groq", "c")]
+    # no stats yet, in the given order
+    assert router.order(routes) == routes
+    router._record(routes[0], latency=2.0)
+    router._record(routes[1], latency=0.5)
+    assert router.order(routes) == [routes[1], routes[0], routes[2]]
+    # many errors, tried last
+    for _ in range(5):
+        router._record(routes[1], error=True)
+    assert router.order(routes)[-1] == routes[1]
+
+
+def test_router_fallback():
+    chat, stream, calls = _fake_provider({"openai": (0, None), "anthropic": (0, "hello")})
+    router = Router(chat, stream)
+    routes = [Route("openai", "a"), Route("anthropic", "b")]
+    assert asyncio.run(router.achat(MSGS, routes)) == "hello"
+    assert calls == ["openai", "anthropic"]
+    assert router.stats["openai"].error_rate > 0
+
+
+def test_router_hedge():
+    chat, stream, calls = _fake_provider(
+        {"openai": (1.0, "slow reply"), "anthropic": (0.01, "fast reply")}
+    )
+    router = Router(chat, stream, hedge_after=0.05)
+    routes = [Route("openai", "a"), Route("anthropic", "b")]
+
+    async def collect():
+        return "".join([c async for c in router.astream(MSGS, routes)])
+
+    t0 = time.perf_counter()
+    assert asyncio.run(collect()) == "fast reply "
+    # didn't wait for the slow provider, which was cancelled
+    assert time.perf_counter() - t0 < 0.5
+    assert calls == ["openai", "anthropic"]
+
+
+def test_init_fallbacks(monkeypatch):
+    initialized = []
+    monkeypatch.setattr(
+        "devopsx.init.init_llm", lambda provider, primary: initialized.append(provider)
+    )
+    routes = _init_fallbacks(
+        "anthropic", "openai/gpt-4o,openrouter/meta-llama/llama-3.1-70b,anthropic/claude-3-haiku,openai/gpt-4o-mini"
+    )
+    # only the first of the providers sharing the OpenAI client is used
+    assert [str(r) for r in routes] == [
+        "openai/gpt-4o",
+        "anthropic/claude-3-haiku",
+        "openai/gpt-4o-mini",
+    ]
+    assert initialized == ["openai"]
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Serves chat completions like an OpenAI-compatible API, or fails."""
+
+    reply: str | None = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        if self.reply is None:
+            # a client error, so the SDK doesn't retry
+            self.send_response(400)
+            self.send_header("content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "bad request"}}')
+            return
+        assert body["stream"]
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.end_headers()
+        for word in self.reply.split(" "):
+            chunk = {
+                "id": "1",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(reply: str | None) -> ThreadingHTTPServer:
+    handler = type("Handler", (_FakeOpenAIHandler,), {"reply": reply})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_stream_fallback_http(monkeypatch):
+    # the primary fails, the fallback is a different provider
+    down, up = _serve(None), _serve("hello from groq")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{down.server_port}/v1")
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("GROQ_BASE_URL", f"http://127.0.0.1:{up.server_port}")
+    monkeypatch.setattr("devopsx.llm_openai.openai", None)
+    monkeypatch.setattr("devopsx.llm_groq.groq", None)
+    monkeypatch.setattr(llm, "_provider", None)
+    monkeypatch.setattr(llm, "_router", Router(llm.achat_complete, llm.astream))
+    try:
+        llm.init_llm("openai")
+        llm.init_llm("groq", primary=False)
+        llm.init_routing([Route("groq", "llama3")])
+        assert "".join(llm._stream(MSGS, "llama3")) == "hello from groq "
+        assert llm._router.stats["openai"].error_rate > 0
+    finally:
+        down.shutdown()
+        up.shutdown()
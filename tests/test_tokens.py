@@ -0,0 +1,103 @@
+import subprocess
+import sys
+
+import pytest
+from devopsx.message import Message, len_tokens
+from devopsx.models import get_model
+from devopsx.tokens import Tokenizer, get_tokenizer, preload_encodings
+
+
+def test_get_tokenizer():
+    # created once per model
+    assert get_tokenizer("openai/gpt-4o") is get_tokenizer(get_model("openai/gpt-4o"))
+    assert get_tokenizer("openai/gpt-4o").exact
+
+    # estimated for providers without a local tokenizer
+    tokenizer = get_tokenizer("anthropic/claude-3-5-sonnet-20240620")
+    assert not tokenizer.exact
+    assert tokenizer.count("x" * 35) == 10
+    assert len_tokens(Message("user", "x" * 35), "anthropic") == 10
+
+
+def test_count_batch():
+    tokenizer = get_tokenizer("openai/gpt-4")
+    texts = ["hello world", "hello", "hello world", ""]
+    assert tokenizer.count_batch(texts) == [tokenizer.count(t) for t in texts]
+    assert tokenizer.count_batch(texts) == list(map(len, tokenizer.encode_batch(texts)))
+
+
+def test_count_batch_cached(monkeypatch):
+    monkeypatch.setattr("devopsx.tokens.COUNT_CACHE_SIZE", 10)
+    tokenizer = Tokenizer("gpt-4", get_tokenizer("openai/gpt-4").encoding)
+    encoded: list[str] = []
+    encode_batch = tokenizer.encode_batch
+
+    def encode_batch_recorded(texts):
+        encoded.extend(texts)
+        return encode_batch(texts)
+
+    monkeypatch.setattr(tokenizer, "encode_batch", encode_batch_recorded)
+    msgs = [f"hello {i}" for i in range(8)]
+    counts = tokenizer.count_batch(msgs)
+    assert sorted(encoded) == sorted(msgs)
+
+    # counting a growing log only encodes the new messages
+    encoded.clear()
+    assert tokenizer.count_batch(msgs + ["hi"]) == counts + [tokenizer.count("hi")]
+    assert encoded == ["hi"]
+
+    # the cache stays bounded, evicting the least recently used counts
+    tokenizer.count_batch(["a", "b", "c"])
+    assert len(tokenizer._counts) == 10
+    assert "hello 0" not in tokenizer._counts
+    assert "hi" in tokenizer._counts
+
+
+def test_split():
+    text = "\n".join(f"line {i}" for i in range(100))
+    for tokenizer in [get_tokenizer("openai/gpt-4"), Tokenizer("estimate")]:
+        assert tokenizer.split(text, 1000, 1000) is None
+        split = tokenizer.split(text, 5, 5)
+        assert split
+        assert text.startswith(split[0])
+        assert text.endswith(split[1])
+        assert tokenizer.count(split[0]) <= 6
+
+
+def test_preload_encodings(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "encodings").mkdir()
+    (tmp_path / "encodings" / "cl100k_base.tiktoken").write_text("")
+    assert preload_encodings(tmp_path / "encodings") == ["cl100k_base"]
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+_startup_script = """
+import time
+from devopsx.models import set_default_model
+from devopsx.message import len_tokens
+from devopsx.tokens import warmup
+
+set_default_model("openai/gpt-4o")
+if {warmup}:
+    warmup().join()
+t0 = time.perf_counter()
+len_tokens("hello world")
+print(time.perf_counter() - t0)
+"""
+
+
+@pytest.mark.slow
+def test_warmup_bench():
+    """Measures the first token count in a fresh process, with and without warmup on init."""
+    results = {}
+    for warm in [False, True]:
+        out = subprocess.run(
+            [sys.executable, "-c", _startup_script.format(warmup=warm)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        results[warm] = float(out.strip().splitlines()[-1])
+    print(f"first len_tokens: {results[False]*1000:.1f}ms cold, {results[True]*1000:.1f}ms after warmup")
+    assert results[True] < results[False]
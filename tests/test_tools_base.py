@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from devopsx.tools import ToolUse, ToolUseDetector, init_tools
+
+
+@pytest.fixture(autouse=True)
+def tools():
+    init_tools()
+
+
+def _feed(output: str, chunk_size: int) -> int | None:
+    detector = ToolUseDetector()
+    for i in range(0, len(output), chunk_size):
+        if (end := detector.feed(output[i : i + chunk_size])) is not None:
+            return end
+    return None
+
+
+def _parse_end(output: str) -> int | None:
+    """Where inference paused when parsing the whole output after every character."""
+    for i in range(1, len(output) + 1):
+        if any(t.is_runnable for t in ToolUse.iter_from_content(output[:i])):
+            return i
+    return None
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "Let's list the files:\n```shell\nls\n```\nDone.",
+        "Not runnable:\n```text\nhi\n```\nbut this is:\n  ```ipython\nprint(1)\n```",
+        "Nested:\n```text\n```python\nprint(1)\n```\n```\nafter\n```sh\nls\n```",
+        "XML:\n<tool-use>\n<shell>\nls\n</shell>\n</tool-use>\nDone.",
+        "No tool uses here, ``` just backticks ```",
+    ],
+)
+def test_detector(output):
+    expected = _parse_end(output)
+    for chunk_size in [1, 2, 3, 7, len(output)]:
+        assert _feed(output, chunk_size) == expected
+
+
+def test_detector_not_runnable():
+    assert _feed("```text\nhi\n```\n<tool-use><foo>x</foo></tool-use>", 4) is None
+
+
+@pytest.mark.slow
+def test_detector_bench():
+    # a long reply with codeblocks, ending with a tool use
+    output = ("Some text.\n```text\n" + "line of output\n" * 40 + "```\n") * 25
+    output += "```shell\nls\n```"
+    chunks = [output[i : i + 4] for i in range(0, len(output), 4)]
+    t0 = time.perf_counter()
+    detector = ToolUseDetector()
+    ends = [detector.feed(chunk) for chunk in chunks]
+    print(f"detected in {len(output)} chars: {time.perf_counter() - t0:.4f}s")
+    assert ends[-1] == len(output)
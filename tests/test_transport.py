@@ -0,0 +1,75 @@
+import gzip
+import asyncio
+
+import httpx
+from devopsx import llm_groq, llm_openai
+from devopsx.config import get_config
+from devopsx.transport import (
+    HTTPConfig,
+    SharedTransport,
+    _compress,
+    get_http_client,
+    get_transport,
+)
+
+
+def test_http_config():
+    config = HTTPConfig.from_dict({"max_connections": 10, "read_timeout": 60})
+    assert config.limits.max_connections == 10
+    assert config.timeout.read == 60
+    assert config.timeout.connect == HTTPConfig.connect_timeout
+
+
+def test_pool_per_loop():
+    transport = SharedTransport(HTTPConfig())
+
+    async def get_pools():
+        return transport._get_pool(), transport._get_pool()
+
+    a1, a2 = asyncio.run(get_pools())
+    b1, _ = asyncio.run(get_pools())
+    # shared within a loop, but not across loops
+    assert a1 is a2
+    assert a1 is not b1
+
+
+def test_compress():
+    body = b"hello " * 1000
+    request = httpx.Request("POST", "https://example.com", content=body)
+    compressed = asyncio.run(_compress(request))
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(compressed.content) == body
+
+    # small bodies are sent as-is
+    request = httpx.Request("POST", "https://example.com", content=b"hi")
+    assert asyncio.run(_compress(request)) is request
+
+
+def test_providers_share_transport(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("GROQ_API_KEY", "gsk-test")
+    monkeypatch.setattr(llm_openai, "openai", None)
+    monkeypatch.setattr(llm_groq, "groq", None)
+    llm_openai.init("openai", get_config())
+    llm_groq.init(get_config())
+    for client in [llm_openai.get_client(), llm_groq.get_client()]:
+        assert client._client._transport is get_transport()
+
+
+async def _get_pool(transport: SharedTransport):
+    return transport._get_pool()
+
+
+def test_env_proxy(monkeypatch):
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.example.com:3128")
+    monkeypatch.setenv("NO_PROXY", "localhost")
+    client = get_http_client()
+
+    proxied = client._transport_for_url(httpx.URL("https://api.openai.com/v1"))
+    assert isinstance(proxied, SharedTransport)
+    assert proxied.proxy == "http://proxy.example.com:3128"
+    assert asyncio.run(_get_pool(proxied))._pool._proxy_url.host == b"proxy.example.com"  # type: ignore
+    # clients share the pool of a proxy
+    assert get_http_client()._transport_for_url(httpx.URL("https://api.openai.com")) is proxied
+    # hosts in NO_PROXY are connected to directly
+    assert client._transport_for_url(httpx.URL("https://localhost:8080")) is get_transport()